@@ -0,0 +1,32 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 11:05
+# @Author : Jovan
+# @File : cache_db.py
+# @desc : 各工具共用的本地缓存目录和sqlite连接
+import os
+import sqlite3
+
+
+def cache_dir():
+    '''
+    缓存目录, 可通过环境变量 CV_TOOL_CACHE_DIR 修改, 默认 ~/.cache/cv_tool
+    '''
+    path = os.environ.get('CV_TOOL_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'cv_tool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(name):
+    return os.path.join(cache_dir(), name)
+
+
+def connect(db_path, check_same_thread=True):
+    '''
+    打开sqlite缓存库, WAL模式允许多进程同时读写
+    :param check_same_thread: 调用方自己加锁时可设为False, 允许多个线程共用连接
+    '''
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
@@ -1,31 +1,23 @@
 
-from xml.dom import minidom
 import json
 import glob
 import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from shutil import copyfile
 
 from tqdm import tqdm
 
+from voc_writer import bndbox, to_pretty_xml
 
-# 将self.orderDict中的信息写入本地xml文件，参数filename是xml文件名
 
-def find_name(categories, find_id):
-    for category in categories:
-        id = category['id']
-        supercategory = category['supercategory']
-        name = category['name']
-        if id == find_id:
-            return name
-
-
-
-def Convert_coco_to_voc(annotation_path,JPEGImage_path,out_path):
+def Convert_coco_to_voc(annotation_path,JPEGImage_path,out_path,workers=None):
     '''
     将coco数据转换为voc数据
     :param annotation_path:coco标记文件的地址
     :param JPEGImage_path: coco图片数据集的位置
     :param out_path: 生成的voc数据集保存的位置
+    :param workers: 写xml的进程数, None则使用CPU核心数
     :return:
     '''
     #先创建voc输出文件夹标准格式
@@ -43,18 +35,20 @@ def Convert_coco_to_voc(annotation_path,JPEGImage_path,out_path):
     imgs = data['images']
     annotations = data['annotations']
     categorie=data["categories"]
-    cate_list=list()
     print('JSON文件中_图片总数:' + str(len(imgs)))
-    for i  in range(len(categorie)):
-        for ca in categorie:
-            if ca["id"]==i:
-                cate_list.append(ca["name"])
+    # 类别id -> 类别名, 只建一次
+    cate_dict = {ca["id"]: ca["name"] for ca in categorie}
+    cate_list = [cate_dict[i] for i in range(len(categorie)) if i in cate_dict]
     print("JSON文件中_标注类别:" + str(cate_list))
+    # image_id -> 该图片的全部标注, 只遍历一次annotations
+    img_anns = defaultdict(list)
+    for ann in annotations:
+        img_anns[ann['image_id']].append(ann)
 
+    xml_jobs = []
     #遍历图片json列表
     for img in tqdm(imgs):
         filename = img['file_name']
-        print(filename)
         img_w = img['width']
         img_h = img['height']
         img_id = img['id']
@@ -63,25 +57,54 @@ def Convert_coco_to_voc(annotation_path,JPEGImage_path,out_path):
         person_list = []
         need_class = ["backpack", "handbag"]
         is_save = False
-        #遍历图片标注信息列表
-        for ann in annotations:
-            if ann['image_id'] == img_id:
-                #图片和标记匹配
-                box = convert_boxshape((img_w, img_h), ann['bbox'])
-                # roi_list.append([cate_list[ann['category_id']],box[0], box[1], box[2], box[3]])
-                name = find_name(categorie,ann['category_id'])
-                if name=='person':
-                    person_list.append([name,box[0], box[1], box[2], box[3]])
-                if name in need_class:
-                    is_save = True
-                    roi_list.append([name,box[0], box[1], box[2], box[3]])
-                else:
-                    pass
-                    # print(box)
+        #遍历该图片的标注信息列表
+        for ann in img_anns.get(img_id, ()):
+            box = convert_boxshape((img_w, img_h), ann['bbox'])
+            # roi_list.append([cate_list[ann['category_id']],box[0], box[1], box[2], box[3]])
+            name = cate_dict.get(ann['category_id'])
+            if name=='person':
+                person_list.append([name,box[0], box[1], box[2], box[3]])
+            if name in need_class:
+                is_save = True
+                roi_list.append([name,box[0], box[1], box[2], box[3]])
+            else:
+                pass
+                # print(box)
         if is_save:
             roi_list.extend(person_list)
-            get_xml(filename, [img_w,img_h,3], roi_list,train_xml_out)
+            xml_jobs.append((filename, [img_w,img_h,3], roi_list,train_xml_out))
         # copyfile(os.path.join(JPEGImage_path, filename),os.path.join(train_img_out, filename,))
+    print(f"需要生成的xml数量: {len(xml_jobs)}")
+    write_xmls(xml_jobs, workers)
+
+
+def _write_xml_chunk(jobs):
+    for job in jobs:
+        get_xml(*job)
+    return len(jobs)
+
+
+def write_xmls(xml_jobs, workers=None, chunksize=256):
+    '''
+    多进程生成xml
+    :param xml_jobs: [(img_name, size, roi, outpath), ...] 即get_xml的参数
+    :param workers: 进程数, None则使用CPU核心数, 1为单进程
+    :param chunksize: 每个任务包含的xml数量
+    :return:
+    '''
+    workers = workers or os.cpu_count() or 1
+    chunks = [xml_jobs[i:i + chunksize] for i in range(0, len(xml_jobs), chunksize)]
+    with tqdm(total=len(xml_jobs), desc='write xml') as pbar:
+        if workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                pbar.update(_write_xml_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for count in executor.map(_write_xml_chunk, chunks):
+                    pbar.update(count)
+
+
+
 def convert_boxshape(size, box):
     '''
     coco数据集标注是xmin,ymin,width,height 而voc和yolo是xmin ymin xmax ynax 需要进行转换
@@ -113,57 +136,18 @@ def get_xml(img_name,size,roi,outpath):
     :param roi:[["label1",xmin,ymin,xmax,ymax]["label2",xmin,ymin,xmax,ymax].....]
     :return:
     '''
-    impl = minidom.getDOMImplementation()
-    doc = impl.createDocument(None, None, None)
-    #创建根节点
-    orderlist = doc.createElement("annotation")
-    doc.appendChild(orderlist)
-    #c创建二级节点
-    filename=doc.createElement("filename")
-    filename.appendChild(doc.createTextNode(img_name))
-    orderlist.appendChild(filename)
-    #size节点
-    sizes=doc.createElement("size")
-    width=doc.createElement("width")
-    width.appendChild(doc.createTextNode(str(size[0])))
-    height=doc.createElement("height")
-    height.appendChild(doc.createTextNode(str(size[1])))
-    depth=doc.createElement("depth")
-    depth.appendChild(doc.createTextNode(str(size[2])))
-    sizes.appendChild(width)
-    sizes.appendChild(height)
-    sizes.appendChild(depth)
-    orderlist.appendChild(sizes)
+    #根节点下的filename和size节点
+    children = [
+        ('filename', img_name),
+        ('size', [('width', str(size[0])), ('height', str(size[1])), ('depth', str(size[2]))]),
+    ]
     #object 节点
     for ri in roi:
-        object=doc.createElement("object")
-        name=doc.createElement("name")
-        name.appendChild(doc.createTextNode(ri[0]))
-        object.appendChild(name)
-        bndbox=doc.createElement("bndbox")
-
-        xmin=doc.createElement("xmin")
-        xmin.appendChild(doc.createTextNode(str(ri[1])))
-        bndbox.appendChild(xmin)
-        ymin=doc.createElement("ymin")
-        ymin.appendChild(doc.createTextNode(str(ri[2])))
-        bndbox.appendChild(ymin)
-        xmax=doc.createElement("xmax")
-        xmax.appendChild(doc.createTextNode(str(ri[3])))
-        bndbox.appendChild(xmax)
-        ymax=doc.createElement("ymax")
-        ymax.appendChild(doc.createTextNode(str(ri[4])))
-        bndbox.appendChild(ymax)
-        object.appendChild(bndbox)
-        orderlist.appendChild(object)
-         # 将dom对象写入本地xml文件
-
-    # 打开test.xml文件 准备写入
-    f = open(os.path.join(outpath,img_name[:-4]+'.xml'), 'w')
-    # 写入文件
-    doc.writexml(f, addindent='  ', newl='\n')
-    # 关闭
-    f.close()
+        children.append(('object', [('name', ri[0]), bndbox(ri[1], ri[2], ri[3], ri[4])]))
+
+    # 写入xml文件
+    with open(os.path.join(outpath,img_name[:-4]+'.xml'), 'w') as f:
+        f.write(to_pretty_xml('annotation', children))
 
 if __name__ == "__main__":
     annotation_path=r"E:\code\tools\data\instances_val2014.json"
@@ -0,0 +1,103 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 13:40
+# @Author : Jovan
+# @File : coco_writer.py
+# @desc : 增量写COCO json, images/annotations边生成边写入, 内存占用与数据集大小无关
+import json
+import os
+import shutil
+import tempfile
+
+
+class CocoJsonWriter:
+    """
+        流式写出COCO格式json
+        images直接写入输出文件, 在images结束前产生的annotations先写到临时文件, 结束时再拼接
+        with CocoJsonWriter('val.json') as writer:
+            writer.add_image(img_info)
+            writer.add_annotation(ann)
+            writer.add_category(category_info)
+    """
+
+    def __init__(self, output_path, categories=None, type_name='instances', cls=None):
+        '''
+        :param output_path: 输出json路径
+        :param categories: 类别列表, 也可以之后用add_category追加
+        :param type_name: 顶层"type"字段, None则不写
+        :param cls: json编码类, 比如x2coco.MyEncoder
+        '''
+        self.output_path = output_path
+        self.categories = list(categories or [])
+        self.type_name = type_name
+        self.cls = cls
+        self.image_count = 0
+        self.annotation_count = 0
+
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(out_dir, exist_ok=True)
+        self._tmp_path = output_path + '.tmp'
+        self._out = open(self._tmp_path, 'w', encoding='utf-8')
+        self._out.write('{"images": [')
+        self._spill = tempfile.TemporaryFile('w+', encoding='utf-8', dir=out_dir)
+        self._images_closed = False
+        self._first_annotation = True
+
+    def _dumps(self, obj):
+        return json.dumps(obj, cls=self.cls)
+
+    def add_image(self, image_info):
+        if self._images_closed:
+            raise RuntimeError('images already closed')
+        if self.image_count:
+            self._out.write(', ')
+        self._out.write(self._dumps(image_info))
+        self.image_count += 1
+
+    def add_annotation(self, annotation):
+        f = self._out if self._images_closed else self._spill
+        if not self._first_annotation:
+            f.write(', ')
+        f.write(self._dumps(annotation))
+        self._first_annotation = False
+        self.annotation_count += 1
+
+    def add_category(self, category_info):
+        self.categories.append(category_info)
+
+    def close_images(self):
+        '''
+        结束images数组, 把暂存的annotations写入输出, 之后的annotations直接写输出文件
+        '''
+        if self._images_closed:
+            return
+        self._out.write(']')
+        if self.type_name is not None:
+            self._out.write(', "type": ' + self._dumps(self.type_name))
+        self._out.write(', "annotations": [')
+        self._spill.seek(0)
+        shutil.copyfileobj(self._spill, self._out, 1024 * 1024)
+        self._spill.close()
+        self._images_closed = True
+
+    def close(self):
+        self.close_images()
+        self._out.write('], "categories": ' + self._dumps(self.categories) + '}')
+        self._out.close()
+        os.replace(self._tmp_path, self.output_path)
+
+    def abort(self):
+        if not self._spill.closed:
+            self._spill.close()
+        self._out.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -4,9 +4,11 @@
 # @Author : Jovan
 # @File : counting.py
 # @desc : 传入两次坐标计算进出
-from collections import deque
+from collections import OrderedDict, deque
 import math
 
+import numpy as np
+
 
 def line_angle(line):
     '''
@@ -80,20 +82,71 @@ def get_line_cross_point(line1, line2):
 from loguru import logger
 
 
+class _Track:
+    """
+        单个目标的状态: 上一次的中心点、上下(左右)方向是否已计数、最后更新的帧号
+    """
+    __slots__ = ('midpoint', 'up', 'down', 'frame_id')
+
+    def __init__(self, midpoint, frame_id):
+        self.midpoint = midpoint
+        self.up = 0
+        self.down = 0
+        self.frame_id = frame_id
+
+
+class _CountedWindow:
+    """
+        最近maxlen次过线的目标id, 淘汰顺序同deque(maxlen=maxlen), 用计数字典做O(1)的成员判断
+    """
+    __slots__ = ('maxlen', '_queue', '_count')
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._queue = deque()
+        self._count = {}
+
+    def append(self, pid):
+        if len(self._queue) == self.maxlen:
+            old = self._queue.popleft()
+            if self._count[old] == 1:
+                del self._count[old]
+            else:
+                self._count[old] -= 1
+        self._queue.append(pid)
+        self._count[pid] = self._count.get(pid, 0) + 1
+
+    def __contains__(self, pid):
+        return pid in self._count
+
+    def __iter__(self):
+        return iter(self._queue)
+
+    def __len__(self):
+        return len(self._queue)
+
+
 class Line:
     """
         支持360度划线设置
         input: dict; for example  line = {'line1': [[730, 408], [1150, 408]], 'line2': [[1280, 435], [1920, 889]]}
+        max_age: 超过max_age帧没有更新的目标被清除, 再出现时当作新目标, None不按帧清除
+        max_tracks: 最多保留的目标数, 超过时清除最久没有更新的目标, None不限制
+        cell_size: 线段网格索引的格子边长(像素), None则按线段分布自动选择
     """
 
-    def __init__(self, line):
-        self.history = {}
+    def __init__(self, line, max_age=300, max_tracks=100000, cell_size=None):
+        # pid -> _Track, 按最后更新的先后排列, 队首是最久没有更新的目标
+        self.tracks = OrderedDict()
+        self.max_age = max_age
+        self.max_tracks = max_tracks
         self.line_angle = {}
         self.line = line
-        self.already_counted = deque(maxlen=50)
+        self.already_counted = _CountedWindow(maxlen=50)
+        # pid -> 已清除的_Track, 再出现时沿用计数状态, 仍在already_counted里时与没有清除的目标计数一致
+        self._evicted = {}
         self.frame_id = 0
         self.result = {}
-        self.idstate = {}
         for i in line:
             self.result[i] = {'up_count': 0, 'down_count': 0}
             temp_line = line[i]
@@ -103,64 +156,249 @@ class Line:
             else:
                 line_divide = "leftright"
             self.line_angle[i] = line_divide
+        # 按线段下标缓存端点、直线系数、计数方向和外接框, [M, 2, 2] / [M, 3] / [M] / [M, 4]
+        self._line_names = list(line)
+        self._line_xy = np.asarray([line[i] for i in self._line_names]).reshape(-1, 2, 2)
+        self._line_abc = np.asarray([calc_abc_from_line_2d(line[i]) for i in self._line_names]).reshape(-1, 3)
+        self._line_axis = np.asarray([1 if self.line_angle[i] == "updown" else 0 for i in self._line_names],
+                                     dtype=np.int64)
+        self._line_bbox = np.concatenate([self._line_xy.min(axis=1), self._line_xy.max(axis=1)], axis=1)
+        self._build_grid(cell_size)
+
+    def _build_grid(self, cell_size=None):
+        '''
+        把线段按外接框登记到均匀网格, 移动线段只需要和所在格子里的线段比较
+        '''
+        self._grid = {}
+        # update逐个目标时用的python数值, 不经过numpy以保持与原始坐标相同的类型
+        self._scalar_lines = []
+        for j, i in enumerate(self._line_names):
+            (lx0, ly0), (lx1, ly1) = self.line[i]
+            self._scalar_lines.append((i, self.line[i], calc_abc_from_line_2d(self.line[i]), int(self._line_axis[j]),
+                                       (min(lx0, lx1), min(ly0, ly1), max(lx0, lx1), max(ly0, ly1))))
+        if not self._line_names:
+            self._grid_box = None
+            return
+        x0, y0 = self._line_bbox[:, :2].min(axis=0).tolist()
+        x1, y1 = self._line_bbox[:, 2:].max(axis=0).tolist()
+        if cell_size is None:
+            # 大约sqrt(M) x sqrt(M)个格子
+            cell_size = max(x1 - x0, y1 - y0) / math.ceil(math.sqrt(len(self._line_names)))
+        cell_size = max(float(cell_size), 1.0)
+        self._grid_box = (x0, y0, x1, y1, cell_size)
+        for j, (bx0, by0, bx1, by1) in enumerate(self._line_bbox.tolist()):
+            for gx in range(int((bx0 - x0) // cell_size), int((bx1 - x0) // cell_size) + 1):
+                for gy in range(int((by0 - y0) // cell_size), int((by1 - y0) // cell_size) + 1):
+                    self._grid.setdefault((gx, gy), []).append(j)
+
+    def _candidates(self, sx0, sy0, sx1, sy1):
+        '''
+        外接框可能与[sx0, sy0, sx1, sy1]重叠的线段下标, 按线段顺序
+        '''
+        if self._grid_box is None:
+            return ()
+        x0, y0, x1, y1, cell_size = self._grid_box
+        if sx1 < x0 or sx0 > x1 or sy1 < y0 or sy0 > y1:
+            return ()
+        gx0, gx1 = int((max(sx0, x0) - x0) // cell_size), int((min(sx1, x1) - x0) // cell_size)
+        gy0, gy1 = int((max(sy0, y0) - y0) // cell_size), int((min(sy1, y1) - y0) // cell_size)
+        if gx0 == gx1 and gy0 == gy1:
+            return self._grid.get((gx0, gy0), ())
+        candidates = set()
+        for gx in range(gx0, gx1 + 1):
+            for gy in range(gy0, gy1 + 1):
+                candidates.update(self._grid.get((gx, gy), ()))
+        return sorted(candidates)
+
+    def _evict(self, frame_id):
+        '''
+        清除超过max_age帧没有更新的目标
+        '''
+        if len(self._evicted) > self.already_counted.maxlen:
+            # 已离开already_counted的目标再出现时本来就会清零, 不用保留; 在帧开始时清理, 不影响本帧的计数
+            self._evicted = {pid: track for pid, track in self._evicted.items() if pid in self.already_counted}
+        if self.max_age is None:
+            return
+        tracks = self.tracks
+        while tracks:
+            pid, track = next(iter(tracks.items()))
+            if frame_id - track.frame_id <= self.max_age:
+                break
+            del tracks[pid]
+            self._evicted[pid] = track
+
+    def _track(self, pid, midpoint, frame_id):
+        '''
+        更新目标的中心点, 返回(目标状态, 上一次的中心点), 新目标的上一次中心点就是当前中心点
+        '''
+        track = self.tracks.get(pid)
+        if track is None:
+            track = self.tracks[pid] = _Track(midpoint, frame_id)
+            evicted = self._evicted.pop(pid, None)
+            if evicted is not None:
+                # 是否清零仍由already_counted决定
+                track.up, track.down = evicted.up, evicted.down
+            if self.max_tracks is not None and len(self.tracks) > self.max_tracks:
+                old_pid, old_track = self.tracks.popitem(last=False)
+                self._evicted[old_pid] = old_track
+        else:
+            self.tracks.move_to_end(pid)
+        previous_midpoint = track.midpoint
+        track.midpoint = midpoint
+        track.frame_id = frame_id
+        return track, previous_midpoint
+
+    def getstate(self, pid):
+        '''
+        目标的计数状态, 不存在(或已清除)时返回None
+        Returns:{'midpoint': [x, y], 'up_count': 0/1, 'down_count': 0/1, 'frame_id': 最后更新的帧号}
+        '''
+        track = self.tracks.get(pid)
+        if track is None:
+            return None
+        return {'midpoint': track.midpoint, 'up_count': track.up, 'down_count': track.down,
+                'frame_id': track.frame_id}
+
+    def _count_cross(self, i, track, cross, current, previous):
+        '''
+        与线段i相交后按交点方向计数
+        Args:
+            cross: 交点在计数方向上的坐标(updown为y, leftright为x)
+            current: 当前中心点在计数方向上的坐标
+            previous: 上一次中心点在计数方向上的坐标
+        '''
+        if cross < current and track.down != 1:
+            self.result[i]['down_count'] = self.result[i]['down_count'] + 1
+            track.down = 1
+
+        elif cross > current and track.up != 1:
+            self.result[i]['up_count'] = self.result[i]['up_count'] + 1
+            track.up = 1
+
+        else:
+            if current < previous and track.up != 1:
+                self.result[i]['up_count'] = self.result[i]['up_count'] + 1
+                track.up = 1
+
+            elif current >= previous and track.down != 1:
+                self.result[i]['down_count'] = self.result[i]['down_count'] + 1
+                track.down = 1
 
     def update(self, pid, cen1, cen2, frame_id):
         midpoint = [int(cen1), int(cen2)]
-        if pid not in self.history:
-            self.history[pid] = deque(maxlen=2)
         self.frame_id = frame_id
-        self.history[pid].append(midpoint)
-        previous_midpoint = self.history[pid][0]
-
-        pid_up_count = str(pid) + "_up_count"
-        pid_down_count = str(pid) + "_down_count"
-
+        self._evict(frame_id)
+        track, previous_midpoint = self._track(pid, midpoint, frame_id)
         if pid not in self.already_counted:
-            self.idstate[pid_up_count] = 0
-            self.idstate[pid_down_count] = 0
-        for i in self.line:
-            temp = self.line[i]
+            track.up = 0
+            track.down = 0
+        (mx, my), (px, py) = midpoint, previous_midpoint
+        sx0, sx1 = (mx, px) if mx < px else (px, mx)
+        sy0, sy1 = (my, py) if my < py else (py, my)
+        for j in self._candidates(sx0, sy0, sx1, sy1):
+            i, temp, (a0, b0, c0), axis, (bx0, by0, bx1, by1) = self._scalar_lines[j]
+            # 外接框不重叠时不可能相交
+            if sx1 < bx0 or sx0 > bx1 or sy1 < by0 or sy0 > by1:
+                continue
             if intersect(midpoint, previous_midpoint, temp[0], temp[1]):
-                cp_xy = get_line_cross_point(temp, [midpoint, previous_midpoint])
-                if cp_xy:
-                    cp_x, cp_y = cp_xy[0], cp_xy[1]
-                    if self.line_angle[i] == "updown":
-                        if cp_y < midpoint[1] and self.idstate[pid_down_count] != 1:
-                            self.result[i]['down_count'] = self.result[i]['down_count'] + 1
-                            self.idstate[pid_down_count] = 1
-
-                        elif cp_y > midpoint[1] and self.idstate[pid_up_count] != 1:
-                            self.result[i]['up_count'] = self.result[i]['up_count'] + 1
-                            self.idstate[pid_up_count] = 1
-
-                        else:
-                            if midpoint[1] < previous_midpoint[1] and self.idstate[pid_up_count] != 1:
-                                self.result[i]['up_count'] = self.result[i]['up_count'] + 1
-                                self.idstate[pid_up_count] = 1
-
-                            elif midpoint[1] >= previous_midpoint[1] and self.idstate[pid_down_count] != 1:
-                                self.result[i]['down_count'] = self.result[i]['down_count'] + 1
-                                self.idstate[pid_down_count] = 1
-                    else:
-
-                        if cp_x < midpoint[0] and self.idstate[pid_down_count] != 1:
-                            self.result[i]['down_count'] = self.result[i]['down_count'] + 1
-                            self.idstate[pid_down_count] = 1
-
-                        elif cp_x > midpoint[0] and self.idstate[pid_up_count] != 1:
-                            self.result[i]['up_count'] = self.result[i]['up_count'] + 1
-                            self.idstate[pid_up_count] = 1
-                        else:
-                            if midpoint[0] < previous_midpoint[0] and self.idstate[pid_up_count] != 1:
-                                self.result[i]['up_count'] = self.result[i]['up_count'] + 1
-                                self.idstate[pid_up_count] = 1
-
-                            elif midpoint[0] >= previous_midpoint[0] and self.idstate[pid_down_count] != 1:
-                                self.result[i]['down_count'] = self.result[i]['down_count'] + 1
-                                self.idstate[pid_down_count] = 1
+                # 同get_line_cross_point(temp, [midpoint, previous_midpoint]), 使用缓存的直线系数
+                a1, b1, c1 = my - py, px - mx, mx * py - px * my
+                D = a0 * b1 - a1 * b0
+                if D != 0:
+                    # updown比较y坐标, leftright比较x坐标
+                    cross = (a1 * c0 - a0 * c1) / D if axis == 1 else (b0 * c1 - b1 * c0) / D
+                    self._count_cross(i, track, cross, midpoint[axis], previous_midpoint[axis])
 
                 self.already_counted.append(pid)
 
+    def update_batch(self, frame_id, ids, cx, cy):
+        '''
+        一帧内多个目标一起更新, 所有目标与所有线段的相交判断和交点用NumPy广播计算, 结果与逐个调用update相同
+        Args:
+            frame_id: 帧号
+            ids: 目标id列表
+            cx: 中心点x坐标列表, 与ids一一对应
+            cy: 中心点y坐标列表, 与ids一一对应
+        '''
+        ids = list(ids)
+        if len(set(ids)) != len(ids):
+            # 同一帧内id重复时后一次依赖前一次的位置, 逐个更新
+            for pid, cen1, cen2 in zip(ids, cx, cy):
+                self.update(pid, cen1, cen2, frame_id)
+            return
+        self.frame_id = frame_id
+        self._evict(frame_id)
+        if not ids:
+            return
+        # 与int()一致, 向0取整
+        midpoints = np.stack([np.asarray(cx).astype(np.int64), np.asarray(cy).astype(np.int64)], axis=1).tolist()
+        previous = []
+
+        tracks = []
+        for pid, midpoint in zip(ids, midpoints):
+            track, previous_midpoint = self._track(pid, midpoint, frame_id)
+            tracks.append(track)
+            previous.append(previous_midpoint)
+
+        rows, cols, cross = self._batch_cross(np.asarray(midpoints), np.asarray(previous))
+        rows, cols = rows.tolist(), cols.tolist()
+        line_names, line_axis = self._line_names, self._line_axis.tolist()
+        event = 0
+        for k, pid in enumerate(ids):
+            if pid not in self.already_counted:
+                tracks[k].up = 0
+                tracks[k].down = 0
+            # rows按目标升序, 同一目标内按线段顺序, 与update的遍历顺序一致
+            while event < len(rows) and rows[event] == k:
+                j = cols[event]
+                if cross[event] is not None:
+                    axis = line_axis[j]
+                    self._count_cross(line_names[j], tracks[k], cross[event], midpoints[k][axis], previous[k][axis])
+                self.already_counted.append(pid)
+                event += 1
+
+    def _batch_cross(self, midpoint, previous):
+        '''
+        计算N个移动线段与M条线段的相交情况
+        Args:
+            midpoint: [N, 2] 当前中心点
+            previous: [N, 2] 上一次中心点
+        Returns:(rows, cols, cross) 相交的目标下标、线段下标(按目标、线段顺序)和交点在计数方向上的坐标,
+                平行时交点为None
+        '''
+        lines, bbox = self._line_xy, self._line_bbox
+        if not len(lines):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, []
+        # 先用外接框筛出可能相交的组合, 再只对这些组合做相交判断
+        seg_min, seg_max = np.minimum(midpoint, previous), np.maximum(midpoint, previous)
+        overlap = ((seg_max[:, None, 0] >= bbox[None, :, 0]) & (seg_min[:, None, 0] <= bbox[None, :, 2]) &
+                   (seg_max[:, None, 1] >= bbox[None, :, 1]) & (seg_min[:, None, 1] <= bbox[None, :, 3]))
+        rows, cols = np.nonzero(overlap)
+        A, B = midpoint[rows], previous[rows]
+        C, D = lines[cols, 0, :], lines[cols, 1, :]
+
+        def _ccw(P, Q, R):
+            return (R[:, 1] - P[:, 1]) * (Q[:, 0] - P[:, 0]) > (Q[:, 1] - P[:, 1]) * (R[:, 0] - P[:, 0])
+
+        hit = (_ccw(A, C, D) != _ccw(B, C, D)) & (_ccw(A, B, C) != _ccw(A, B, D))
+        rows, cols = rows[hit], cols[hit]
+        if not len(rows):
+            return rows, cols, []
+
+        # 同get_line_cross_point(line, [midpoint, previous_midpoint]), 只算相交的组合
+        a0, b0, c0 = self._line_abc[cols].T
+        (mx, my), (px, py) = midpoint[rows].T, previous[rows].T
+        a1, b1, c1 = my - py, px - mx, mx * py - px * my
+        det = a0 * b1 - a1 * b0
+        parallel = det == 0
+        det = np.where(parallel, 1, det)
+        axis = self._line_axis[cols]
+        cross = np.where(axis == 1, (a1 * c0 - a0 * c1) / det, (b0 * c1 - b1 * c0) / det).tolist()
+        for event in np.flatnonzero(parallel).tolist():
+            cross[event] = None
+        return rows, cols, cross
+
     def getdata(self):
         return self.result
 
@@ -0,0 +1,301 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 22:40
+# @Author : Jovan
+# @File : counting_service.py
+# @desc : 多路视频过线计数服务, 一个进程托管多路counting.Line, 按路分到多个工作进程, asyncio收发检测结果
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import zlib
+
+from counting import Line
+
+# 回复线程检查工作进程是否存活的间隔(秒)
+LIVENESS_INTERVAL = 1.0
+
+
+def _worker_main(inbox, outbox, line_kwargs):
+    '''
+    工作进程: 维护分到本进程的各路Line, 按收到的顺序处理命令
+    命令为元组 (op, request_id, stream_id, *args), request_id为None时不回复
+    '''
+    streams = {}
+    while True:
+        op, request_id, stream_id, *args = inbox.get()
+        if op == 'stop':
+            break
+        try:
+            if op == 'update':
+                streams[stream_id].update_batch(*args)
+                reply = None
+            elif op == 'add':
+                streams[stream_id] = Line(args[0], **line_kwargs)
+                reply = True
+            elif op == 'remove':
+                reply = streams.pop(stream_id, None) is not None
+            elif op == 'getdata':
+                reply = streams[stream_id].getdata()
+            elif op == 'snapshot':
+                reply = {sid: line.getdata() for sid, line in streams.items()}
+            else:
+                raise ValueError(f'unknown op {op}')
+        except Exception as e:
+            if request_id is None:
+                print(f"stream:{stream_id},op:{op},error:{e!r}")
+            else:
+                outbox.put((request_id, False, repr(e)))
+            continue
+        if request_id is not None:
+            outbox.put((request_id, True, reply))
+
+
+class MultiStreamCounter:
+    """
+        多路过线计数, 每一路(stream)固定分到一个工作进程, 同一路的检测结果按提交顺序处理
+        counter = MultiStreamCounter(workers=4)
+        await counter.start()
+        await counter.add_stream('cam1', {'line1': [[730, 408], [1150, 408]]})
+        counter.update('cam1', frame_id, ids, cx, cy)
+        print(await counter.getdata('cam1'))
+        await counter.stop()
+    """
+
+    def __init__(self, workers=None, timeout=None, **line_kwargs):
+        '''
+        :param workers: 工作进程数, None则使用CPU核心数
+        :param timeout: 每个请求等待回复的最长时间(秒), 超时抛出asyncio.TimeoutError, None则一直等待
+        :param line_kwargs: 传给counting.Line的参数, 如max_age, max_tracks
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.line_kwargs = line_kwargs
+        self._inboxes = []
+        self._processes = []
+        self._outbox = None
+        self._reader = None
+        # request_id -> (shard, future)
+        self._pending = {}
+        # 已退出的工作进程下标, 发往这些进程的请求直接失败
+        self._dead = set()
+        self._request_ids = itertools.count()
+        self._loop = None
+
+    def shard_of(self, stream_id):
+        '''
+        stream_id所在的工作进程下标, 与进程启动方式和hash随机化无关
+        '''
+        return zlib.crc32(str(stream_id).encode('utf-8')) % self.workers
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        ctx = mp.get_context('spawn')
+        self._outbox = ctx.Queue()
+        for _ in range(self.workers):
+            inbox = ctx.Queue()
+            process = ctx.Process(target=_worker_main, args=(inbox, self._outbox, self.line_kwargs), daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        # 回复由后台线程读出, 再交给事件循环
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def _read_replies(self):
+        reported = set()
+        last_check = time.monotonic()
+        while True:
+            try:
+                item = self._outbox.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                self._loop.call_soon_threadsafe(self._resolve, *item)
+            if not item or time.monotonic() - last_check >= LIVENESS_INTERVAL:
+                last_check = time.monotonic()
+                # 工作进程异常退出后不会再回复, 让发往它的请求失败而不是一直等待
+                for shard, process in enumerate(self._processes):
+                    if shard not in reported and not process.is_alive():
+                        reported.add(shard)
+                        self._loop.call_soon_threadsafe(self._fail_shard, shard, process.exitcode)
+
+    def _resolve(self, request_id, ok, reply):
+        shard, future = self._pending.pop(request_id, (None, None))
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(reply)
+        else:
+            future.set_exception(RuntimeError(reply))
+
+    def _fail_shard(self, shard, exitcode):
+        self._dead.add(shard)
+        for request_id, (request_shard, future) in list(self._pending.items()):
+            if request_shard == shard:
+                del self._pending[request_id]
+                if not future.done():
+                    future.set_exception(self._dead_error(shard, exitcode))
+
+    def _dead_error(self, shard, exitcode=None):
+        if exitcode is None:
+            exitcode = self._processes[shard].exitcode
+        return RuntimeError(f'counting worker {shard} exited with code {exitcode}')
+
+    async def _request(self, shard, op, stream_id=None, *args):
+        if shard in self._dead:
+            raise self._dead_error(shard)
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = (shard, future)
+        self._inboxes[shard].put((op, request_id, stream_id, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def add_stream(self, stream_id, line):
+        '''
+        添加一路, 已存在时重新创建(计数清零)
+        :param line: 同counting.Line的line参数
+        '''
+        return await self._request(self.shard_of(stream_id), 'add', stream_id, line)
+
+    async def remove_stream(self, stream_id):
+        '''
+        :return: 该路存在时返回True
+        '''
+        return await self._request(self.shard_of(stream_id), 'remove', stream_id)
+
+    def update(self, stream_id, frame_id, ids, cx, cy):
+        '''
+        提交一路一帧的检测结果, 不等待处理完成; 该路的工作进程已退出时抛出RuntimeError
+        '''
+        shard = self.shard_of(stream_id)
+        if shard in self._dead:
+            raise self._dead_error(shard)
+        self._inboxes[shard].put(('update', None, stream_id, frame_id, list(ids), list(cx), list(cy)))
+
+    async def getdata(self, stream_id):
+        '''
+        一路当前的计数, 包含此前提交的所有检测结果
+        '''
+        return await self._request(self.shard_of(stream_id), 'getdata', stream_id)
+
+    async def snapshot(self):
+        '''
+        所有路当前的计数 {stream_id: getdata()}
+        '''
+        parts = await asyncio.gather(*[self._request(shard, 'snapshot') for shard in range(self.workers)])
+        result = {}
+        for part in parts:
+            result.update(part)
+        return result
+
+    async def consume(self, queue):
+        '''
+        从asyncio.Queue读取(stream_id, frame_id, ids, cx, cy)并提交, 读到None结束
+        '''
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            self.update(*item)
+
+    async def _handle_client(self, reader, writer):
+        # 每行一个json命令, update不回复, 其余命令回复一行json
+        while True:
+            data = await reader.readline()
+            if not data:
+                break
+            try:
+                msg = json.loads(data)
+                op = msg.get('op')
+                if op == 'update':
+                    self.update(msg['stream'], msg['frame_id'], msg['ids'], msg['cx'], msg['cy'])
+                    continue
+                if op == 'add':
+                    reply = await self.add_stream(msg['stream'], msg['line'])
+                elif op == 'remove':
+                    reply = await self.remove_stream(msg['stream'])
+                elif op == 'getdata':
+                    reply = await self.getdata(msg['stream'])
+                elif op == 'snapshot':
+                    reply = await self.snapshot()
+                else:
+                    raise ValueError(f'unknown op {op}')
+                response = {'ok': True, 'result': reply}
+            except Exception as e:
+                response = {'ok': False, 'error': repr(e)}
+            writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        '''
+        在本地socket上提供服务, 直到被取消
+        :param path: unix socket路径, 指定时忽略host和port
+        '''
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle_client, path=path)
+        else:
+            server = await asyncio.start_server(self._handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def stop(self):
+        for shard, inbox in enumerate(self._inboxes):
+            if shard not in self._dead:
+                inbox.put(('stop', None, None))
+        for process in self._processes:
+            await self._loop.run_in_executor(None, process.join)
+        self._outbox.put(None)
+        self._reader.join()
+        # 回复线程退出前提交给事件循环的回调先执行完
+        await asyncio.sleep(0)
+        for _, future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+        self._dead.clear()
+        self._inboxes, self._processes = [], []
+
+
+async def _serve(args):
+    counter = MultiStreamCounter(workers=args.workers, timeout=args.timeout, max_age=args.max_age,
+                                 max_tracks=args.max_tracks)
+    await counter.start()
+    try:
+        print(f"counting service on {args.path or f'{args.host}:{args.port}'}, {counter.workers} workers")
+        await counter.serve(args.host, args.port, args.path)
+    finally:
+        await counter.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', help='listen host', default='127.0.0.1')
+    parser.add_argument('--port', help='listen port', type=int, default=8765)
+    parser.add_argument('--path', help='unix socket path, overrides host and port', default=None)
+    parser.add_argument('--workers', help='worker processes, default cpu count', type=int, default=None)
+    parser.add_argument('--timeout', help='seconds to wait for a worker reply, default no limit', type=float,
+                        default=None)
+    parser.add_argument('--max_age', help='drop tracks not updated for this many frames', type=int, default=300)
+    parser.add_argument('--max_tracks', help='max tracks kept per stream', type=int, default=100000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,5 @@
 import os
-import hashlib
 import shutil
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
 import time
 import imghdr
 
@@ -11,15 +8,20 @@ SOURCE_DIR = 'JPEGImages'  # 要扫描的源目录路径
 DUPLICATE_DIR = "imagesduplicate"  # 备份目录路径（重复文件将移到这里）
 USE_FAST_HASH = True  # 是否使用快速哈希模式 (True/False)
 MIN_FILE_SIZE = 4096  # 最小处理的图片大小(字节)
+HASH_POOL = 'thread'  # 计算完整哈希用线程池('thread')或进程池('process')
 
 import os
-import hashlib
+import sys
 import shutil
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
 import imghdr
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_dedup import find_duplicate_files
+from file_scan import iter_files
+from image_meta import get_default_store
+
 
 # ======== 配置区域 ========
 # SOURCE_DIR = "/path/to/your/image/folder"  # 源图片文件夹路径
@@ -30,50 +32,15 @@ import time
 
 # =========================
 
-def is_valid_image(file_path):
-    """验证文件是否为有效图片"""
-    try:
-        # 验证文件扩展名和实际格式匹配
-        if imghdr.what(file_path) is None:
-            return False
-        # 快速验证图片文件头
-        with open(file_path, 'rb') as f:
-            header = f.read(16)
-            return header.startswith(b'\xFF\xD8') or header.startswith(b'\x89PNG') or \
-                header.startswith(b'GIF') or header.startswith(b'\x49\x49') or \
-                header.startswith(b'MM')
-    except (OSError, IOError):
+def is_valid_header(header):
+    """根据文件开头的字节验证是否为有效图片"""
+    # 验证文件扩展名和实际格式匹配
+    if imghdr.what(None, h=header) is None:
         return False
-
-
-def get_file_signature(file_path):
-    """获取文件的哈希签名（快速模式或完整模式）"""
-    # 创建自定义哈希对象（BLAKE2比MD5/SHA更快）
-    hasher = hashlib.blake2b(digest_size=16)
-
-    if USE_FAST_HASH:
-        # 快速模式 - 采样读取关键部分
-        size = os.path.getsize(file_path)
-        with open(file_path, 'rb') as f:
-            # 文件开头
-            hasher.update(f.read(4096))
-
-            # 文件中段（如果文件足够大）
-            if size > 8192:
-                f.seek(size // 2 - 2048)
-                hasher.update(f.read(4096))
-
-            # 文件末尾（如果文件足够大）
-            if size > 12288:
-                f.seek(-4096, 2)
-                hasher.update(f.read(4096))
-    else:
-        # 完整模式 - 逐块读取整个文件
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(128 * 1024), b''):
-                hasher.update(chunk)
-
-    return hasher.hexdigest()
+    # 快速验证图片文件头
+    return header.startswith(b'\xFF\xD8') or header.startswith(b'\x89PNG') or \
+        header.startswith(b'GIF') or header.startswith(b'\x49\x49') or \
+        header.startswith(b'MM')
 
 
 def find_image_duplicates():
@@ -81,57 +48,13 @@ def find_image_duplicates():
     print(f"📂 开始扫描图片目录: {SOURCE_DIR}")
     start_time = time.time()
 
-    # 第一步：按大小预分组（快速筛选）
-    size_map = defaultdict(list)
-    file_count = 0
-
-    for root, _, files in os.walk(SOURCE_DIR):
-        for name in files:
-            path = os.path.join(root, name)
-            if not os.path.isfile(path):
-                continue
-
-            try:
-                size = os.path.getsize(path)
-                if size < MIN_FILE_SIZE:
-                    continue
-
-                if not is_valid_image(path):
-                    continue
-
-                size_map[size].append(path)
-                file_count += 1
-            except OSError:
-                continue
-
-    print(f"🔍 发现 {file_count} 个有效图片文件（大小 > {MIN_FILE_SIZE} 字节）")
-    print(f"⏱ 初始扫描耗时: {time.time() - start_time:.2f} 秒")
-
-    # 第二步：并行计算哈希签名
-    print(f"🧮 开始计算文件签名（{'快速模式' if USE_FAST_HASH else '完整模式'}）...")
-    hash_map = defaultdict(list)
-    with ThreadPoolExecutor(max_workers=os.cpu_count() * 2) as executor:
-        futures = {}
-        # 只处理可能有重复的大小组
-        for size, paths in size_map.items():
-            if len(paths) > 1:
-                for path in paths:
-                    futures[executor.submit(get_file_signature, path)] = path
-
-        # 收集结果
-        for i, future in enumerate(futures):
-            try:
-                path = futures[future]
-                file_hash = future.result()
-                hash_map[file_hash].append(path)
-
-                if (i + 1) % 500 == 0:
-                    print(f"🔄 处理进度: {i + 1}/{len(futures)} 个文件")
-            except Exception as e:
-                print(f"⚠️ 处理失败 [{path}]: {str(e)}")
-
-    # 第三步：识别重复项
-    duplicates = {h: paths for h, paths in hash_map.items() if len(paths) > 1}
+    # 第一步：流式扫描，按大小预分组（快速筛选），大小相同的文件边扫描边校验格式、计算采样哈希
+    # 第二步：分阶段计算哈希（采样哈希只用来排除，结果按完整哈希确认），直接得到重复的组
+    print(f"🧮 开始计算文件签名（{'采样+完整' if USE_FAST_HASH else '完整'}，大小 >= {MIN_FILE_SIZE} 字节）...")
+    get_default_store().preload(SOURCE_DIR)
+    duplicates = find_duplicate_files(iter_files(SOURCE_DIR, MIN_FILE_SIZE), use_sample=USE_FAST_HASH,
+                                      hash_pool=HASH_POOL, validate_header=is_valid_header)
+    get_default_store().flush()
 
     print(f"✅ 去重分析完成！发现 {len(duplicates)} 组重复图片")
     print(f"⏱ 总耗时: {time.time() - start_time:.2f} 秒")
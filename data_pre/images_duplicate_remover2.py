@@ -1,24 +1,36 @@
 import os
-import hashlib
+import sys
 import time
 import shutil
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
 import imghdr
 import logging
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_dedup import find_duplicate_files
+from file_scan import iter_files
+from image_meta import get_default_store
+
 
 class ImageDeduplicator:
-    def __init__(self, src_dir, dup_dir, min_file_size=4096, fast_mode=True, keep_mode="first", max_workers=None):
+    def __init__(self, src_dir, dup_dir, min_file_size=4096, fast_mode=True, keep_mode="first", max_workers=None,
+                 near_mode=None, max_distance=4, incremental=False, reference_dir=None, hash_pool="thread"):
         """
         初始化图片去重器
 
         :param src_dir: 源图片目录路径
         :param dup_dir: 重复文件存放目录路径
         :param min_file_size: 最小处理的文件大小（字节），默认为4KB
-        :param fast_mode: 是否使用快速模式（采样哈希），默认为True
+        :param fast_mode: 是否先用采样哈希排除不同的文件，默认为True；结果总是按完整哈希确认
         :param keep_mode: 保留模式，可选 "first"（保留第一个）、"last"（保留最后一个）、"oldest"（最旧文件）
         :param max_workers: 最大并发线程数，None则使用CPU核心数*2
+        :param near_mode: 近似重复模式, None（只找字节完全相同的文件）、"phash" 或 "dhash"（找重新编码/缩放过的同一画面）
+        :param max_distance: 近似重复模式下感知哈希的最大汉明距离（0~63）
+        :param incremental: 增量模式, 用持久化哈希索引只检查上次运行后新增/修改的文件, 已有文件保留不动
+        :param reference_dir: 参考库目录, 指定后只检查源目录中与参考库重复的文件, 参考库文件保留不动;
+                              参考库的索引不存在时先扫描一次
+        :param hash_pool: 计算完整哈希用 "thread"（线程池）或 "process"（进程池，适合文件都在页缓存里、CPU成为瓶颈时），
+                          读取方式由hash_backend按文件大小自动选择，可先用 python hash_backend.py 目录 测速
         """
         self.src_dir = os.path.abspath(src_dir)
         self.dup_dir = os.path.abspath(dup_dir)
@@ -26,6 +38,15 @@ class ImageDeduplicator:
         self.fast_mode = fast_mode
         self.keep_mode = keep_mode
         self.max_workers = max_workers or (os.cpu_count() * 2)
+        self.near_mode = near_mode
+        self.max_distance = max_distance
+        self.incremental = incremental
+        self.hash_pool = hash_pool
+        self.reference_dir = os.path.abspath(reference_dir) if reference_dir else None
+        # 需要保留原位的文件（增量模式的已有文件、参考库文件）
+        self.protected_files = set()
+        # 增量/参考库模式的哈希索引, 重复文件处理完后才提交本次扫描到的新文件
+        self.hash_index = None
 
         # 日志记录
         self.total_images = 0
@@ -46,6 +67,10 @@ class ImageDeduplicator:
         self.logger = logging.getLogger()
 
         # 验证配置
+        if near_mode is not None and near_mode not in ("phash", "dhash"):
+            raise ValueError(f"不支持的近似重复模式: {near_mode}")
+        if near_mode is not None and (incremental or reference_dir):
+            raise ValueError("近似重复模式不支持增量/参考库模式")
         if not os.path.isdir(self.src_dir):
             raise ValueError(f"源目录不存在: {self.src_dir}")
         os.makedirs(self.dup_dir, exist_ok=True)
@@ -53,6 +78,17 @@ class ImageDeduplicator:
         # 支持的图片格式
         self.supported_formats = {"jpg", "jpeg", "png", "gif", "bmp", "tiff", "webp"}
 
+        # 图片元数据缓存, 未改动的文件不重复计算哈希
+        self.meta_store = get_default_store()
+
+    def is_valid_header(self, header):
+        """根据文件开头的字节判断是否为支持的图片格式"""
+        if not header:
+            return False
+        # 使用imghdr检测格式
+        file_format = imghdr.what(None, h=header)
+        return bool(file_format) and file_format.lower() in self.supported_formats
+
     def is_valid_image(self, file_path):
         """验证文件是否为有效的图片格式并满足最小大小要求"""
         try:
@@ -62,54 +98,16 @@ class ImageDeduplicator:
 
             # 检查文件头
             with open(file_path, 'rb') as f:
-                header = f.read(16)
-                if not header:
-                    return False
-
-                # 使用imghdr检测格式
-                file_format = imghdr.what(None, h=header)
-                return file_format and file_format.lower() in self.supported_formats
+                return self.is_valid_header(f.read(16))
         except (OSError, IOError):
             return False
 
-    def calculate_file_hash(self, file_path):
-        """计算文件的哈希值"""
-        hasher = hashlib.blake2b(digest_size=16)
-        file_size = os.path.getsize(file_path)
-
-        # 对大文件使用采样策略
-        if self.fast_mode and file_size > 1024 * 1024:  # >1MB的文件使用快速采样
-            with open(file_path, 'rb') as f:
-                # 文件头
-                hasher.update(f.read(4096))
-
-                # 文件中段
-                if file_size > 8192:
-                    f.seek(file_size // 2 - 2048)
-                    hasher.update(f.read(4096))
-
-                # 文件尾
-                if file_size > 12288:
-                    f.seek(-4096, 2)
-                    hasher.update(f.read(4096))
-        else:
-            # 完整文件哈希
-            with open(file_path, 'rb') as f:
-                # 使用内存视图优化性能
-                while chunk := f.read(65536):
-                    hasher.update(chunk)
-
-        return hasher.hexdigest()
-
-    def process_image(self, file_info):
-        """处理单个图像文件并计算哈希值"""
-        file_path, file_size = file_info
-        try:
-            if self.is_valid_image(file_path):
-                return self.calculate_file_hash(file_path), file_path, file_size
-        except Exception as e:
-            self.logger.error(f"处理文件 {file_path} 时出错: {str(e)}")
-        return None, None, None
+    def scan_images(self):
+        """流式扫描源目录, 逐个产出达到最小大小的候选文件（文件路径, os.stat_result）"""
+        self.total_images = 0
+        for file_path, st in iter_files(self.src_dir, self.min_file_size):
+            self.total_images += 1
+            yield file_path, st
 
     def find_duplicates(self):
         """查找目录中的重复图片"""
@@ -118,73 +116,136 @@ class ImageDeduplicator:
         self.logger.info(f"⚡ 使用 {'快速' if self.fast_mode else '完整'} 模式检测重复")
         self.logger.info(f"📏 最小处理大小: {self.min_file_size} 字节")
 
-        # 收集候选图片文件（文件路径 + 文件大小）
-        candidate_images = []
-        for root, _, files in os.walk(self.src_dir):
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                if not os.path.isfile(file_path):
-                    continue
-
-                try:
-                    file_size = os.path.getsize(file_path)
-                    # 首先检查文件大小是否达到最小要求
-                    if file_size >= self.min_file_size:
-                        candidate_images.append((file_path, file_size))
-                except OSError as e:
-                    self.logger.warning(f"无法获取文件大小: {file_path}: {str(e)}")
-
-        self.total_images = len(candidate_images)
-        if not candidate_images:
+        if self.incremental or self.reference_dir:
+            return self.find_indexed_duplicates(start_time)
+
+        if self.near_mode:
+            # 感知哈希需要全部候选文件
+            candidate_images = list(self.scan_images())
+            if not candidate_images:
+                self.logger.warning("⚠️ 没有找到符合条件的图片文件")
+                return {}
+            self.logger.info(f"📊 发现 {self.total_images} 个候选图片文件")
+            return self.find_near_duplicates(candidate_images, start_time)
+
+        # 分阶段哈希: 大小 -> 采样哈希 -> 完整哈希, 边扫描边读取大小相同的文件,
+        # 格式校验和哈希共用一次文件读取
+        self.meta_store.preload(self.src_dir)
+        hash_map = find_duplicate_files(self.scan_images(), use_sample=self.fast_mode, max_workers=self.max_workers,
+                                        store=self.meta_store, log=self.logger.info, hash_pool=self.hash_pool,
+                                        validate_header=self.is_valid_header)
+        self.meta_store.flush()
+        if not self.total_images:
             self.logger.warning("⚠️ 没有找到符合条件的图片文件")
             return {}
-
         self.logger.info(f"📊 发现 {self.total_images} 个候选图片文件")
 
-        # 并行处理所有候选图片
-        hash_map = defaultdict(list)
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self.process_image, file_info) for file_info in candidate_images]
+        # 识别重复项（完整哈希相同的文件）
+        duplicates = {}
+        for file_hash, files in hash_map.items():
+            # 按路径排序确保可预测性
+            duplicates[file_hash] = sorted(files)
+            self.duplicate_groups += 1
 
-            for i, future in enumerate(futures):
-                file_hash, file_path, file_size = future.result()
-                if file_hash and file_path and file_size:
-                    hash_map[file_hash].append((file_path, file_size))
+        self.processing_time = time.time() - start_time
+        self.logger.info(f"✅ 发现 {self.duplicate_groups} 组重复图片")
+        self.logger.info(f"⏱ 检测耗时: {self.processing_time:.2f}秒")
+
+        return duplicates
+
+    def find_near_duplicates(self, candidate_images, start_time):
+        """按感知哈希查找近似重复图片, 解码失败的文件跳过"""
+        from perceptual_hash import cluster_near_duplicates, compute_hashes
+
+        self.logger.info(f"🧮 计算感知哈希（{self.near_mode}，最大汉明距离 {self.max_distance}）")
+        paths = [file_path for file_path, _ in candidate_images]
+        # 解码和DCT是CPU密集的, 用进程池
+        hashes = compute_hashes(paths, desc=self.near_mode)
+        hash_index = 0 if self.near_mode == "phash" else 1
+        valid = [(path, file_hash[hash_index]) for path, file_hash in zip(paths, hashes) if file_hash is not None]
+        if len(valid) < len(paths):
+            self.logger.warning(f"⚠️ {len(paths) - len(valid)} 个文件无法解码, 已跳过")
+
+        groups = cluster_near_duplicates([file_hash for _, file_hash in valid], self.max_distance)
+        duplicates = {}
+        for group_index, group in enumerate(groups):
+            files = sorted(valid[i][0] for i in group)
+            # 前8位是组号, 保证每组的存放目录不同
+            duplicates[f"{group_index:08x}{valid[group[0]][1]:016x}"] = files
+        self.duplicate_groups = len(duplicates)
 
-                # 进度报告
-                if i % 500 == 0 or i == len(candidate_images) - 1:
-                    processed = i + 1
-                    self.logger.info(f"🔄 处理中: {processed}/{self.total_images} ({processed / self.total_images:.1%})")
+        self.processing_time = time.time() - start_time
+        self.logger.info(f"✅ 发现 {self.duplicate_groups} 组近似重复图片")
+        self.logger.info(f"⏱ 检测耗时: {self.processing_time:.2f}秒")
+        return duplicates
 
-        # 识别重复项（哈希值相同的文件）
+    def find_indexed_duplicates(self, start_time):
+        """用持久化哈希索引查找重复: 增量模式或与参考库比对"""
+        from file_dedup import HashIndex
+
+        index = HashIndex(hash_pool=self.hash_pool)
+        try:
+            # 新文件先不记入索引, move_duplicates之后再提交, 中途中断时下次仍会检查这些文件
+            files, new = index.scan(self.src_dir, self.min_file_size)
+            self.total_images = len(files)
+            self.logger.info(f"📊 发现 {self.total_images} 个候选图片文件, 其中 {len(new)} 个新增或修改")
+            if self.reference_dir:
+                if not index.has_root(self.reference_dir):
+                    self.logger.info(f"📚 建立参考库索引: {self.reference_dir}")
+                    index.scan(self.reference_dir, self.min_file_size, commit=True)
+                if self.incremental:
+                    files = [(path, size) for path, size in files if path in new]
+                hash_map, self.protected_files = index.check_against(files, self.reference_dir, self.is_valid_image,
+                                                                     self.max_workers)
+            else:
+                hash_map, self.protected_files = index.find_new_duplicates(files, new, self.is_valid_image,
+                                                                           self.max_workers)
+        except BaseException:
+            index.close()
+            raise
+        self.hash_index = index
+
+        # 保留的文件排在前面
         duplicates = {}
         for file_hash, files in hash_map.items():
-            if len(files) > 1:
-                # 按路径排序确保可预测性
-                duplicates[file_hash] = [file_path for file_path, _ in sorted(files)]
-                self.duplicate_groups += 1
+            duplicates[file_hash] = sorted(files, key=lambda path: (path not in self.protected_files, path))
+        self.duplicate_groups = len(duplicates)
 
         self.processing_time = time.time() - start_time
         self.logger.info(f"✅ 发现 {self.duplicate_groups} 组重复图片")
         self.logger.info(f"⏱ 检测耗时: {self.processing_time:.2f}秒")
-
         return duplicates
 
+    def commit_index(self, moved=()):
+        """重复文件处理完后把本次扫描到的新文件记入哈希索引, 下次增量运行不再检查"""
+        if self.hash_index is None:
+            return
+        self.hash_index.commit(removed=moved)
+        self.hash_index.close()
+        self.hash_index = None
+
     def move_duplicates(self, duplicates):
         """移动重复文件到指定目录"""
         if not duplicates:
             self.logger.info("🎉 未发现重复图片")
+            self.commit_index()
             return
 
         self.logger.info(f"🚚 开始移动重复文件到: {self.dup_dir}")
         start_time = time.time()
         moved_count = 0
         freed_space = 0
+        moved_files = []
 
         # 为每个哈希组创建目标子目录
         for file_hash, files in duplicates.items():
             # 确定要保留的文件（保持原位置）
-            if self.keep_mode == "first":
+            protected = [f for f in files if f in self.protected_files]
+            if protected:
+                # 已有文件/参考库文件保留, 只移动新文件
+                keep_file = protected[0]
+                move_files = [f for f in files if f not in self.protected_files]
+            elif self.keep_mode == "first":
                 keep_file = files[0]
                 move_files = files[1:]
             elif self.keep_mode == "last":
@@ -217,6 +278,7 @@ class ImageDeduplicator:
                     # 获取文件大小并移动
                     file_size = os.path.getsize(file_path)
                     shutil.move(file_path, dest_path)
+                    moved_files.append(file_path)
 
                     freed_space += file_size
                     moved_count += 1
@@ -229,6 +291,8 @@ class ImageDeduplicator:
                 except Exception as e:
                     self.logger.error(f"移动失败 {file_path}: {str(e)}")
 
+        self.commit_index(moved_files)
+
         # 更新统计数据
         self.files_moved = moved_count
         self.space_freed = freed_space
@@ -271,6 +335,9 @@ if __name__ == "__main__":
     MIN_FILE_SIZE = 100  # 字节
     FAST_MODE = True
     KEEP_MODE = "first"  # "first", "last" or "oldest"
+    NEAR_MODE = None  # None, "phash" or "dhash"
+    MAX_DISTANCE = 4
+    HASH_POOL = "thread"  # "thread" or "process"
 
     # 执行去重
     try:
@@ -279,7 +346,10 @@ if __name__ == "__main__":
             dup_dir=DUPLICATE_DIR,
             min_file_size=MIN_FILE_SIZE,
             fast_mode=FAST_MODE,
-            keep_mode=KEEP_MODE
+            keep_mode=KEEP_MODE,
+            near_mode=NEAR_MODE,
+            max_distance=MAX_DISTANCE,
+            hash_pool=HASH_POOL
         )
 
         duplicates = deduper.find_duplicates()
@@ -6,103 +6,44 @@
 
 import json
 import os
-from xml.dom.minidom import Document, parse
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voc_writer import bndbox, to_pretty_xml
 
 
 def gen_xml_2(json_name, json_data, root_dir):
     xml_name = os.path.splitext(json_name)[0] + '.xml'
     img_name = os.path.splitext(json_name)[0] + '.jpg'
-    doc = Document()
-    annotation = doc.createElement("annotation")
-    doc.appendChild(annotation)
-
-    folder = doc.createElement("folder")
-    annotation.appendChild(folder)
-    folder.appendChild(doc.createTextNode('train_imgs'))
-
-    filename = doc.createElement("filename")
-    annotation.appendChild(filename)
-    filename.appendChild(doc.createTextNode(img_name))
-
-    path = doc.createElement("path")
-    annotation.appendChild(path)
-    path.appendChild(doc.createTextNode(os.path.join(root_dir, img_name)))
-
-    source = doc.createElement("source")
-    annotation.appendChild(source)
-    database = doc.createElement("database")
-    source.appendChild(database)
-    database.appendChild(doc.createTextNode('Unknown'))
-
-    size = doc.createElement("size")
-    annotation.appendChild(size)
-
-    width = doc.createElement("width")
-    size.appendChild(width)
-    width.appendChild(doc.createTextNode(str(json_data['size']['width'])))
-
-    height = doc.createElement("height")
-    size.appendChild(height)
-    height.appendChild(doc.createTextNode(str(json_data['size']['height'])))
-
-    depth = doc.createElement("depth")
-    size.appendChild(depth)
-    depth.appendChild(doc.createTextNode('3'))
-
-    segmented = doc.createElement("segmented")
-    annotation.appendChild(segmented)
-    segmented.appendChild(doc.createTextNode('0'))
-    objects = json_data['outputs']['object']
     ig_class = ['mask', 'helmet', 'hline', 'head', 'face']
-    for i in objects:
+    objects = []
+    for i in json_data['outputs']['object']:
         if i['name'] in ig_class:
             continue
-        obj = doc.createElement("object")
-        annotation.appendChild(obj)
-
-        name = doc.createElement("name")
-        name.appendChild(doc.createTextNode(str(i['name'])))
-
-        pose = doc.createElement("pose")
-        pose.appendChild(doc.createTextNode('Unspecified'))
-
-        truncated = doc.createElement("truncated")
-        truncated.appendChild(doc.createTextNode('0'))
-
-        occluded = doc.createElement("occluded")
-        occluded.appendChild(doc.createTextNode('0'))
-
-        difficult = doc.createElement("difficult")
-        difficult.appendChild(doc.createTextNode('0'))
-
-        bndbox = doc.createElement("bndbox")
-
-        obj.appendChild(name)
-        obj.appendChild(pose)
-        obj.appendChild(truncated)
-        obj.appendChild(occluded)
-        obj.appendChild(difficult)
-        obj.appendChild(bndbox)
-        obj.appendChild(bndbox)
-
-        xmin = doc.createElement("xmin")
-        xmin.appendChild(doc.createTextNode(str(round(i['bndbox']['xmin']))))
-
-        ymin = doc.createElement("ymin")
-        ymin.appendChild(doc.createTextNode(str(round(i['bndbox']['ymin']))))
-
-        xmax = doc.createElement("xmax")
-        xmax.appendChild(doc.createTextNode(str(round(i['bndbox']['xmax']))))
-
-        ymax = doc.createElement("ymax")
-        ymax.appendChild(doc.createTextNode(str(round(i['bndbox']['ymax']))))
-
-        bndbox.appendChild(xmin)
-        bndbox.appendChild(ymin)
-        bndbox.appendChild(xmax)
-        bndbox.appendChild(ymax)
+        objects.append(('object', [
+            ('name', str(i['name'])),
+            ('pose', 'Unspecified'),
+            ('truncated', '0'),
+            ('occluded', '0'),
+            ('difficult', '0'),
+            bndbox(round(i['bndbox']['xmin']), round(i['bndbox']['ymin']),
+                   round(i['bndbox']['xmax']), round(i['bndbox']['ymax'])),
+        ]))
+    xml_str = to_pretty_xml('annotation', [
+        ('folder', 'train_imgs'),
+        ('filename', img_name),
+        ('path', os.path.join(root_dir, img_name)),
+        ('source', [('database', 'Unknown')]),
+        ('size', [
+            ('width', str(json_data['size']['width'])),
+            ('height', str(json_data['size']['height'])),
+            ('depth', '3'),
+        ]),
+        ('segmented', '0'),
+    ] + objects)
     with open(os.path.join(root_dir, xml_name), 'w') as f:
-        f.write(doc.toprettyxml(indent="  "))
+        f.write(xml_str)
 
 
 def convert():
@@ -6,8 +6,12 @@
 
 import json
 import os
+import sys
 import time
-import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voc_parser import parse_voc_xmls
 
 
 def xml_to_json_third(root_dir):
@@ -17,29 +21,27 @@ def xml_to_json_third(root_dir):
     if not os.path.exists(json_path):
         os.mkdir(json_path)
     files = os.listdir(xml_path)
+    annotations = parse_voc_xmls([os.path.join(xml_path, xmlfile) for xmlfile in files])
     count = 0
-    for xmlfile in files:
+    for xmlfile, annotation in zip(files, annotations):
         count += 1
-        path_ = os.path.join(xml_path, xmlfile)
-        tree = ET.parse(path_)
-        root = tree.getroot()
+        if annotation is None:
+            continue
         json_name = xmlfile.split('.')[0]
         img_path = os.path.join(jpg_path, json_name + ".jpg")
-        size = root.find('size')
         try:
-            depth = int(float(size.find('depth').text))
+            depth = int(annotation.depth)
         except:
             depth = 3
-        height = int(float(size.find('height').text))
-        width = int(float(size.find('width').text))
+        height = int(annotation.height)
+        width = int(annotation.width)
         list_object = []
-        for object in root.iter('object'):
-            name = object.find('name').text
-            bndbox = object.find('bndbox')
-            xmin = int(float(bndbox.find('xmin').text))
-            ymin = int(float(bndbox.find('ymin').text))
-            xmax = int(float(bndbox.find('xmax').text))
-            ymax = int(float(bndbox.find('ymax').text))
+        for object in annotation.objects:
+            name = object.name
+            xmin = int(object.xmin)
+            ymin = int(object.ymin)
+            xmax = int(object.xmax)
+            ymax = int(object.ymax)
             list_object.append(dict(name=name, bndbox=dict(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)))
 
         json_dic = dict(path=img_path, outputs=dict(object=list_object), time_labeled=int(time.time()),
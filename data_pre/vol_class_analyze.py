@@ -7,65 +7,31 @@
 
 import json
 import os
+import sys
 import time
-import xml.etree.ElementTree as ET
-from xml.dom.minidom import Document
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voc_parser import parse_voc_xmls
+from voc_writer import bndbox, to_pretty_xml
+
 
 def gen_xml_2(all_class, json_data, root_dir, img1):
     xml_name = os.path.splitext(os.path.basename(img1))[0] + '.xml'
     img_name = img1
     # img_name = os.path.splitext(os.path.basename(img1))[0] + '.jpg'
     json_names = os.path.splitext(os.path.basename(img1))[0] + '.json'
-    doc = Document()
-    annotation = doc.createElement("annotation")
-    doc.appendChild(annotation)
-
-    folder = doc.createElement("folder")
-    annotation.appendChild(folder)
-    folder.appendChild(doc.createTextNode('train_imgs'))
-
-    filename = doc.createElement("filename")
-    annotation.appendChild(filename)
-    filename.appendChild(doc.createTextNode(img_name))
-
-    path = doc.createElement("path")
-    annotation.appendChild(path)
-    path.appendChild(doc.createTextNode(img_name))
-
-    source = doc.createElement("source")
-    annotation.appendChild(source)
-    database = doc.createElement("database")
-    source.appendChild(database)
-    database.appendChild(doc.createTextNode('Unknown'))
-
-    size = doc.createElement("size")
-    annotation.appendChild(size)
-
-    width = doc.createElement("width")
-    size.appendChild(width)
     try:
-        width.appendChild(doc.createTextNode(str(json_data['size']['width'])))
+        width = str(json_data['size']['width'])
     except Exception as e:
         print(f"width error:{json_names}")
-        width.appendChild(doc.createTextNode(str(1920)))
-
-    height = doc.createElement("height")
-    size.appendChild(height)
+        width = str(1920)
     try:
-        height.appendChild(doc.createTextNode(str(json_data['size']['height'])))
+        height = str(json_data['size']['height'])
     except Exception as e:
-        height.appendChild(doc.createTextNode(str(1080)))
+        height = str(1080)
         print(f"height error:{json_names}")
-
-    depth = doc.createElement("depth")
-    size.appendChild(depth)
-    depth.appendChild(doc.createTextNode('3'))
-
-    segmented = doc.createElement("segmented")
-    annotation.appendChild(segmented)
-    segmented.appendChild(doc.createTextNode('0'))
     try:
         objects = json_data.get('outputs', None)
         if objects is None:
@@ -76,56 +42,30 @@ def gen_xml_2(all_class, json_data, root_dir, img1):
         objects = []
         print(f" objects error:{json_names}")
     is_continue = False
+    object_nodes = []
     for i in objects:
         name_ = i['name'].strip()
         all_class.add(name_)
-        obj = doc.createElement("object")
-        annotation.appendChild(obj)
-
-        name = doc.createElement("name")
-        name.appendChild(doc.createTextNode(str(name_)))
-
-        pose = doc.createElement("pose")
-        pose.appendChild(doc.createTextNode('Unspecified'))
-
-        truncated = doc.createElement("truncated")
-        truncated.appendChild(doc.createTextNode('0'))
-
-        occluded = doc.createElement("occluded")
-        occluded.appendChild(doc.createTextNode('0'))
-
-        difficult = doc.createElement("difficult")
-        difficult.appendChild(doc.createTextNode('0'))
-
-        bndbox = doc.createElement("bndbox")
-
-        obj.appendChild(name)
-        obj.appendChild(pose)
-        obj.appendChild(truncated)
-        obj.appendChild(occluded)
-        obj.appendChild(difficult)
-        obj.appendChild(bndbox)
-        obj.appendChild(bndbox)
-
-        xmin = doc.createElement("xmin")
-        xmin.appendChild(doc.createTextNode(str(round(i['bndbox']['xmin']))))
-
-        ymin = doc.createElement("ymin")
-        ymin.appendChild(doc.createTextNode(str(round(i['bndbox']['ymin']))))
-
-        xmax = doc.createElement("xmax")
-        xmax.appendChild(doc.createTextNode(str(round(i['bndbox']['xmax']))))
-
-        ymax = doc.createElement("ymax")
-        ymax.appendChild(doc.createTextNode(str(round(i['bndbox']['ymax']))))
-
-        bndbox.appendChild(xmin)
-        bndbox.appendChild(ymin)
-        bndbox.appendChild(xmax)
-        bndbox.appendChild(ymax)
+        object_nodes.append(('object', [
+            ('name', str(name_)),
+            ('pose', 'Unspecified'),
+            ('truncated', '0'),
+            ('occluded', '0'),
+            ('difficult', '0'),
+            bndbox(round(i['bndbox']['xmin']), round(i['bndbox']['ymin']),
+                   round(i['bndbox']['xmax']), round(i['bndbox']['ymax'])),
+        ]))
     if not is_continue:
+        xml_str = to_pretty_xml('annotation', [
+            ('folder', 'train_imgs'),
+            ('filename', img_name),
+            ('path', img_name),
+            ('source', [('database', 'Unknown')]),
+            ('size', [('width', width), ('height', height), ('depth', '3')]),
+            ('segmented', '0'),
+        ] + object_nodes)
         with open(os.path.join(root_dir, xml_name), 'w') as f:
-            f.write(doc.toprettyxml(indent="  "))
+            f.write(xml_str)
 
 
 def scan_pic(x, y,name):
@@ -166,7 +106,7 @@ def analyze_xml(src_dir,classes):
     :param src_dir:
     :return:
     '''
-    src_xml_list = os.listdir(src_dir)
+    src_xml_list = [os.path.join(src_dir, xmlfile) for xmlfile in os.listdir(src_dir)]
     count = 0
     all_class = set()
     width_list = []
@@ -174,29 +114,25 @@ def analyze_xml(src_dir,classes):
     box_w_list = []
     box_h_list = []
     classes_count = {}
-    for xmlfile in src_xml_list:
+    for annotation in parse_voc_xmls(src_xml_list):
+        if annotation is None:
+            continue
         count += 1
-        path_ = os.path.join(src_dir, xmlfile)
-        tree = ET.parse(path_)
-        root = tree.getroot()
-        img_path = root.find('filename').text
-        size = root.find('size')
-        height = int(float(size.find('height').text))
-        width = int(float(size.find('width').text))
+        height = int(annotation.height)
+        width = int(annotation.width)
         width_list.append(width)
         height_list.append(height)
-        for object in root.iter('object'):
-            name = object.find('name').text.strip()
+        for object in annotation.objects:
+            name = object.name.strip()
             if name not in classes_count:
                 classes_count[name] = 1
             else:
                 classes_count[name] = classes_count[name] + 1
             all_class.add(name)
-            bndbox = object.find('bndbox')
-            xmin = int(float(bndbox.find('xmin').text))
-            ymin = int(float(bndbox.find('ymin').text))
-            xmax = int(float(bndbox.find('xmax').text))
-            ymax = int(float(bndbox.find('ymax').text))
+            xmin = int(object.xmin)
+            ymin = int(object.ymin)
+            xmax = int(object.xmax)
+            ymax = int(object.ymax)
             box_w_list.append(xmax-xmin)
             box_h_list.append(ymax-ymin)
     print(f"width_list:{len(width_list)},height_list:{len(height_list)}")
@@ -211,24 +147,22 @@ def analyze_xml(src_dir,classes):
 
 
 def xml_filter_class(src_dir, target_dir, classes):
-    src_xml_list = os.listdir(src_dir)
+    src_xml_list = [os.path.join(src_dir, xmlfile) for xmlfile in os.listdir(src_dir)]
     if not os.path.exists(target_dir):
         os.mkdir(target_dir)
     count = 0
     all_class = set()
-    for xmlfile in src_xml_list:
+    for annotation in parse_voc_xmls(src_xml_list):
+        if annotation is None:
+            continue
         count += 1
-        path_ = os.path.join(src_dir, xmlfile)
-        tree = ET.parse(path_)
-        root = tree.getroot()
-        img_path = root.find('filename').text
-        size = root.find('size')
+        img_path = annotation.filename
         try:
-            height = int(float(size.find('height').text))
+            height = int(annotation.height)
         except:
             height = 1080
         try:
-            width = int(float(size.find('width').text))
+            width = int(annotation.width)
         except:
             width = 1920
         json_data = dict()
@@ -236,15 +170,14 @@ def xml_filter_class(src_dir, target_dir, classes):
         json_data['path'] = img_path
         json_data['size'] = {'width': width, 'height': height}
         json_data['outputs'] = {'object': list_object}
-        for object in root.iter('object'):
-            name = object.find('name').text.strip()
+        for object in annotation.objects:
+            name = object.name.strip()
             if name not in classes:
                 continue
-            bndbox = object.find('bndbox')
-            xmin = int(float(bndbox.find('xmin').text))
-            ymin = int(float(bndbox.find('ymin').text))
-            xmax = int(float(bndbox.find('xmax').text))
-            ymax = int(float(bndbox.find('ymax').text))
+            xmin = int(object.xmin)
+            ymin = int(object.ymin)
+            xmax = int(object.xmax)
+            ymax = int(object.ymax)
             list_object.append(dict(name=name, bndbox=dict(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)))
         json_data['outputs'] = {'object': list_object}
         gen_xml_2(all_class, json_data, target_dir, os.path.basename(img_path))
@@ -0,0 +1,343 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/19 00:10
+# @Author : Jovan
+# @File : file_dedup.py
+# @desc : 分阶段查找内容完全相同的文件: 大小分组 -> 采样哈希 -> 完整哈希, 只对仍然冲突的文件读全文件;
+#          持久化哈希索引支持增量去重和与参考库比对
+import os
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from tqdm import tqdm
+
+import cache_db
+from file_scan import iter_files
+from hash_backend import hash_files, new_hasher
+from image_meta import SAMPLE_BYTES, ImageMetaStore, get_default_store, sample_digest
+
+# 小于这个大小的文件直接算完整哈希, 采样读的字节数和读全文件差不多
+SAMPLE_MIN_SIZE = 64 * 1024
+# sqlite单条语句的参数个数上限以内
+QUERY_BATCH = 500
+
+
+def _safe_call(func, path, *args):
+    try:
+        return func(path, *args)
+    except Exception as e:
+        print(f"file:{path},error:{e}")
+        return None
+
+
+def _regroup(groups, keys):
+    # keys与各组文件依次一一对应, key为None的文件去掉
+    keys = iter(list(keys))
+    result = []
+    for _, group in groups:
+        sub_groups = defaultdict(list)
+        for path in group:
+            key = next(keys)
+            if key is not None:
+                sub_groups[key].append(path)
+        result.extend((key, sub_group) for key, sub_group in sub_groups.items() if len(sub_group) > 1)
+    return result
+
+
+def _probe(store, path, st, use_sample, validate, validate_header):
+    '''
+    大小冲突的文件只打开一次: 读出开头校验格式, 小文件接着读完算完整哈希, 大文件在同一个句柄上算采样哈希
+    :return: ('full', 完整哈希) 已确定; ('sample', 采样哈希) 或 ('size', None) 还需要完整哈希; 无效文件返回None
+    '''
+    if validate is not None and not validate(path):
+        return None
+    meta = store.get(path, st)
+    small = meta.size < SAMPLE_MIN_SIZE
+    if small:
+        cached = None if meta.hash is None else ('full', meta.hash)
+    elif use_sample:
+        cached = None if meta.sample_hash is None else ('sample', meta.sample_hash)
+    else:
+        cached = ('size', None)
+    if cached is not None and validate_header is None:
+        return cached
+    with open(path, 'rb') as f:
+        head = f.read(SAMPLE_BYTES)
+        if validate_header is not None and not validate_header(head):
+            return None
+        if cached is not None:
+            return cached
+        if small:
+            hasher = new_hasher()
+            hasher.update(head)
+            hasher.update(f.read())
+            digest = hasher.hexdigest()
+            store.put(meta._replace(hash=digest))
+            return 'full', digest
+        digest = sample_digest(f, meta.size, head)
+    store.put(meta._replace(sample_hash=digest))
+    return 'sample', digest
+
+
+def find_duplicate_files(files: Iterable[Tuple[str, Union[int, os.stat_result]]], use_sample: bool = True,
+                         max_workers: Optional[int] = None, store: Optional[ImageMetaStore] = None,
+                         validate: Optional[Callable[[str], bool]] = None,
+                         log: Callable[[str], None] = print, hash_pool: str = 'thread',
+                         validate_header: Optional[Callable[[bytes], bool]] = None) -> Dict[str, List[str]]:
+    '''
+    查找内容完全相同的文件, 结果与对所有文件算完整哈希相同
+    1. 按大小分组, 大小唯一的文件不可能重复, 不读文件
+    2. 边扫描边处理: 某个大小出现第二个文件时就提交到线程池, 每个文件只打开一次, 读开头校验格式,
+       小文件直接读完算完整哈希, 较大的文件算采样哈希(头/中/尾), 采样不同的文件一定不同
+    3. 仍然冲突的文件算完整哈希
+    :param files: [(文件路径, 文件大小或os.stat_result), ...], 可以是生成器(如file_scan.iter_files),
+                  传入stat结果时不再重复stat
+    :param use_sample: 是否使用采样哈希阶段
+    :param max_workers: 线程数, None则使用CPU核心数*2
+    :param store: 哈希缓存, None则使用默认缓存
+    :param validate: 只对大小冲突的文件调用, 返回False的文件不参与比较
+    :param log: 输出各阶段统计的函数
+    :param hash_pool: 完整哈希阶段用线程池(thread)还是进程池(process), 读取方式由hash_backend按文件大小选择
+    :param validate_header: 同validate, 但参数是文件开头的SAMPLE_BYTES字节(文件较小时为整个文件), 与哈希共用一次读取
+    :return: {完整哈希: [文件路径, ...]}, 只包含多于一个文件的组, 组内保持输入顺序
+    '''
+    store = store or get_default_store()
+    max_workers = max_workers or (os.cpu_count() or 1) * 2
+    size_map = defaultdict(list)
+    stats = {}
+    futures = {}
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def _submit(path):
+            futures[path] = executor.submit(_safe_call, _probe, store, path, stats.get(path), use_sample,
+                                            validate, validate_header)
+
+        for path, st in files:
+            if isinstance(st, os.stat_result):
+                stats[path] = st
+                st = st.st_size
+            paths = size_map[st]
+            paths.append(path)
+            total += 1
+            if len(paths) == 2:
+                _submit(paths[0])
+            if len(paths) >= 2:
+                _submit(path)
+        groups = [(size, paths) for size, paths in size_map.items() if len(paths) > 1]
+        log(f"size stage: {total} files, {sum(len(paths) for _, paths in groups)} files in {len(groups)} "
+            f"colliding size groups")
+        paths = [path for _, group in groups for path in group]
+        keys = [future.result() for future in tqdm((futures[path] for path in paths), total=len(paths),
+                                                    desc='sample hash' if use_sample else 'validate')]
+    groups = _regroup(groups, keys)
+    done = [(key[1], group) for key, group in groups if key[0] == 'full']
+    groups = [(key, group) for key, group in groups if key[0] != 'full']
+    log(f"sample stage: {sum(len(paths) for _, paths in groups)} files in {len(groups)} colliding groups "
+        f"(+{sum(len(paths) for _, paths in done)} small files already hashed in full)")
+    paths = [path for _, group in groups for path in group]
+    digests = store.content_hashes(paths, workers=max_workers if hash_pool == 'thread' else None, pool=hash_pool,
+                                   stats=stats)
+    groups = done + _regroup(groups, (digests.get(path) for path in paths))
+    log(f"full stage: {sum(len(paths) for _, paths in groups)} files in {len(groups)} duplicate groups")
+    return dict(groups)
+
+
+def _prefix_range(root):
+    prefix = os.path.join(os.path.abspath(root), '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class HashIndex:
+    """
+        文件内容哈希的持久化索引, (路径, 大小, mtime_ns, inode)都没变的文件直接复用上次的哈希
+        index = HashIndex()
+        files, new = index.scan(src_dir)                      # new为新增或修改过的文件
+        duplicates, existing = index.find_new_duplicates(files, new)
+        ...                                                   # 处理重复文件
+        index.commit(removed=moved)                           # 处理完再记入索引, 中途中断时下次仍是新文件
+        duplicates, reference = index.check_against(files, reference_dir)   # 参考库需要先scan(commit=True)过一次
+    """
+
+    def __init__(self, db_path=None, hash_pool='thread'):
+        '''
+        :param hash_pool: 计算哈希用线程池(thread)还是进程池(process)
+        '''
+        self.db_path = db_path or cache_db.cache_path('hash_index.sqlite')
+        self.hash_pool = hash_pool
+        self.conn = cache_db.connect(self.db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS hash_index ('
+                          'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS hash_index_size ON hash_index (size)')
+        # commit=False扫描到、还没写入索引的文件 {路径: (大小, mtime_ns, inode, 哈希)}, 以及要删除的记录
+        self._pending = {}
+        self._pending_deleted = []
+
+    def scan(self, root: str, min_size: int = 0, commit: bool = False) -> Tuple[List[Tuple[str, int]], Set[str]]:
+        '''
+        扫描目录, 找出新增和修改过的文件(哈希留空, 需要时再算)和已不存在的文件
+        :param min_size: 小于这个大小的文件不记录
+        :param commit: False则处理完重复文件后再调用commit()写入索引, 中途中断时下次扫描这些文件仍是新文件;
+                       True则立即写入(比如只用来比对的参考库)
+        :return: (files, new) files为[(绝对路径, 大小), ...], new为新增或修改过的文件路径集合
+        '''
+        rows = {row[0]: row[1:] for row in self.conn.execute(
+            'SELECT path, size, mtime_ns, inode FROM hash_index WHERE path >= ? AND path < ?', _prefix_range(root))}
+        files = []
+        new = set()
+        updates = []
+        for path, st in iter_files(os.path.abspath(root), min_size):
+            files.append((path, st.st_size))
+            signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+            if rows.pop(path, None) != signature:
+                new.add(path)
+                updates.append((path, *signature, None))
+        if commit:
+            self._write(updates, rows)
+        else:
+            self._pending.update((path, row) for path, *row in updates)
+            self._pending_deleted.extend(rows)
+        return files, new
+
+    def _write(self, updates, deleted):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO hash_index VALUES (?, ?, ?, ?, ?)', updates)
+            self.conn.executemany('DELETE FROM hash_index WHERE path=?', [(path,) for path in deleted])
+
+    def commit(self, removed: Iterable[str] = ()):
+        '''
+        把scan(commit=False)扫描到的文件和已算出的哈希写入索引
+        :param removed: 已经移走或删除的文件, 不再记入索引
+        '''
+        deleted = self._pending_deleted
+        for path in removed:
+            self._pending.pop(path, None)
+            deleted.append(path)
+        self._write([(path, *row) for path, row in self._pending.items()], deleted)
+        self._pending = {}
+        self._pending_deleted = []
+
+    def has_root(self, root: str) -> bool:
+        '''
+        索引中是否有这个目录下的文件
+        '''
+        return self.conn.execute('SELECT 1 FROM hash_index WHERE path >= ? AND path < ? LIMIT 1',
+                                 _prefix_range(root)).fetchone() is not None
+
+    def hashes(self, paths: Iterable[str], max_workers: Optional[int] = None) -> Dict[str, str]:
+        '''
+        获取文件的完整哈希, 索引里没有的才读文件计算并写回索引
+        :return: {路径: 哈希}, 读取失败的文件不在结果里
+        '''
+        paths = list(paths)
+        pending = self._pending
+        # 还没提交的文件, 索引里的记录(如果有)是修改前的
+        result = {path: pending[path][3] for path in paths if path in pending and pending[path][3] is not None}
+        indexed = [path for path in paths if path not in pending]
+        for i in range(0, len(indexed), QUERY_BATCH):
+            batch = indexed[i:i + QUERY_BATCH]
+            result.update(self.conn.execute(
+                f'SELECT path, hash FROM hash_index WHERE hash IS NOT NULL AND path IN ({",".join("?" * len(batch))})',
+                batch))
+        missing = [path for path in paths if path not in result]
+        if self.hash_pool != 'thread':
+            max_workers = None
+        updates = []
+        for path, digest in zip(missing, hash_files(missing, pool=self.hash_pool, workers=max_workers)):
+            if digest is not None:
+                result[path] = digest
+                if path in pending:
+                    pending[path] = (*pending[path][:3], digest)
+                else:
+                    updates.append((digest, path))
+        try:
+            with self.conn:
+                self.conn.executemany('UPDATE hash_index SET hash=? WHERE path=?', updates)
+        except sqlite3.Error as e:
+            print(f"hash index write error: {e}")
+        return result
+
+    def paths_by_size(self, sizes: Iterable[int], root: Optional[str] = None) -> Dict[int, List[str]]:
+        '''
+        从索引中查找指定大小的文件, 不扫描目录
+        :param root: 只查找这个目录下的文件
+        '''
+        sizes = list(set(sizes))
+        condition, extra = '', ()
+        if root is not None:
+            condition, extra = ' AND path >= ? AND path < ?', _prefix_range(root)
+        result = defaultdict(list)
+        for i in range(0, len(sizes), QUERY_BATCH):
+            batch = sizes[i:i + QUERY_BATCH]
+            rows = self.conn.execute(f'SELECT path, size FROM hash_index WHERE size IN ({",".join("?" * len(batch))})'
+                                     f'{condition}', (*batch, *extra))
+            for path, size in rows:
+                result[size].append(path)
+        return result
+
+    def _group_by_hash(self, groups, validate, max_workers):
+        # groups: [[路径, ...], ...] 大小相同的文件组
+        if validate is not None:
+            groups = [[path for path in group if validate(path)] for group in groups]
+            groups = [group for group in groups if len(group) > 1]
+        digests = self.hashes([path for group in groups for path in group], max_workers)
+        by_hash = defaultdict(list)
+        for group in groups:
+            for path in group:
+                if path in digests:
+                    by_hash[digests[path]].append(path)
+        return by_hash
+
+    def find_new_duplicates(self, files: List[Tuple[str, int]], new: Set[str],
+                            validate: Optional[Callable[[str], bool]] = None,
+                            max_workers: Optional[int] = None) -> Tuple[Dict[str, List[str]], Set[str]]:
+        '''
+        增量去重: 只检查新文件之间、新文件与已有文件之间的重复, 已有文件之间的重复上次已经处理过
+        只有与新文件大小相同的已有文件才需要哈希, 已有文件的哈希一般已在索引里
+        :param files: scan返回的files
+        :param new: scan返回的new
+        :return: (duplicates, existing) duplicates为{哈希: [路径, ...]}, 每组至少有一个新文件;
+                 existing为组内的已有文件
+        '''
+        new_sizes = {size for path, size in files if path in new}
+        size_map = defaultdict(list)
+        for path, size in files:
+            if size in new_sizes:
+                size_map[size].append(path)
+        groups = [paths for paths in size_map.values() if len(paths) > 1]
+        by_hash = self._group_by_hash(groups, validate, max_workers)
+        duplicates = {digest: paths for digest, paths in by_hash.items()
+                      if len(paths) > 1 and any(path in new for path in paths)}
+        existing = {path for paths in duplicates.values() for path in paths if path not in new}
+        return duplicates, existing
+
+    def check_against(self, files: List[Tuple[str, int]], reference_root: str,
+                      validate: Optional[Callable[[str], bool]] = None,
+                      max_workers: Optional[int] = None) -> Tuple[Dict[str, List[str]], Set[str]]:
+        '''
+        检查文件是否已在参考库中, 参考库只查索引不重新扫描
+        :param files: [(路径, 大小), ...]
+        :param reference_root: 参考库目录, 需要先用scan(commit=True)建立索引, 参考库有变化时需要重新scan
+        :param validate: 只对待检查的文件调用, 返回False的文件不参与比较
+        :return: (duplicates, reference) duplicates为{哈希: [路径, ...]}, 每组至少有一个参考库文件和一个待检查文件;
+                 reference为组内的参考库文件
+        '''
+        reference_map = self.paths_by_size((size for _, size in files), reference_root)
+        checked = {path for path, _ in files}
+        size_map = defaultdict(list)
+        for path, size in files:
+            if size in reference_map and (validate is None or validate(path)):
+                size_map[size].append(path)
+        groups = [[path for path in reference_map[size] if path not in checked] + paths
+                  for size, paths in size_map.items()]
+        by_hash = self._group_by_hash(groups, None, max_workers)
+        duplicates = {}
+        for digest, paths in by_hash.items():
+            if any(path in checked for path in paths) and any(path not in checked for path in paths):
+                duplicates[digest] = paths
+        reference = {path for paths in duplicates.values() for path in paths if path not in checked}
+        return duplicates, reference
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,42 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/19 01:40
+# @Author : Jovan
+# @File : file_scan.py
+# @desc : 基于os.scandir的流式目录扫描, 复用目录项的类型和stat结果, 边扫描边产出文件
+import os
+from typing import Iterator, Tuple
+
+
+def iter_files(root: str, min_size: int = 0) -> Iterator[Tuple[str, os.stat_result]]:
+    '''
+    递归遍历目录下的普通文件(含指向文件的符号链接, 不进入指向目录的符号链接, 同os.walk),
+    文件类型来自目录项本身, 每个文件只stat一次, 而os.walk + isfile + getsize要stat两次
+    :param min_size: 小于这个大小的文件跳过
+    :return: 生成器, 产出(路径, os.stat_result), 路径以root开头
+    '''
+    stack = [root]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            it = os.scandir(dir_path)
+        except OSError as e:
+            print(f"file:{dir_path},error:{e}")
+            continue
+        sub_dirs = []
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError as e:
+                    print(f"file:{entry.path},error:{e}")
+                    continue
+                if st.st_size >= min_size:
+                    yield entry.path, st
+        # 倒序入栈, 子目录按目录项顺序依次处理
+        stack.extend(reversed(sub_dirs))
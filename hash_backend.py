@@ -0,0 +1,196 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/19 01:00
+# @Author : Jovan
+# @File : hash_backend.py
+# @desc : 文件完整哈希的几种读取方式(read/readinto/mmap)和线程池/进程池, 按文件大小自动选择, 附带测速
+import argparse
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from tqdm import tqdm
+
+from file_scan import iter_files
+
+BACKENDS = ['read', 'readinto', 'mmap']
+POOLS = ['thread', 'process']
+# read每次读取的字节数(原来的实现)
+READ_CHUNK = 128 * 1024
+# readinto复用的缓冲区大小
+READINTO_BUFFER = 1024 * 1024
+# 不小于这个大小的文件用mmap, 小文件mmap建立映射的开销比读取还大
+MMAP_MIN_SIZE = 4 * 1024 * 1024
+
+_local = threading.local()
+
+
+def new_hasher():
+    '''
+    所有工具共用的文件哈希: blake2b, 16字节
+    '''
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_read(file_path: str) -> str:
+    hasher = new_hasher()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(READ_CHUNK):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_readinto(file_path: str) -> str:
+    '''
+    每个线程复用一个大缓冲区, 不为每块数据新建bytes
+    '''
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = memoryview(bytearray(READINTO_BUFFER))
+    hasher = new_hasher()
+    with open(file_path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            hasher.update(buffer[:n])
+    return hasher.hexdigest()
+
+
+def hash_mmap(file_path: str) -> str:
+    '''
+    整个文件映射到内存后一次update, 不经过用户态缓冲区; 空文件不能映射, 改用readinto
+    '''
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hash_readinto(file_path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            hasher = new_hasher()
+            hasher.update(mm)
+            return hasher.hexdigest()
+
+
+_BACKEND_FUNCS = {'read': hash_read, 'readinto': hash_readinto, 'mmap': hash_mmap}
+
+
+def hash_file(file_path: str, file_size: Optional[int] = None, backend: str = 'auto') -> str:
+    '''
+    计算整个文件的哈希, 各backend结果相同
+    :param backend: auto 按文件大小选择(大文件mmap, 其余readinto); read / readinto / mmap
+    '''
+    if backend == 'auto':
+        size = os.path.getsize(file_path) if file_size is None else file_size
+        backend = 'mmap' if size >= MMAP_MIN_SIZE else 'readinto'
+    return _BACKEND_FUNCS[backend](file_path)
+
+
+def _hash_one(args):
+    file_path, backend = args
+    try:
+        return hash_file(file_path, backend=backend)
+    except OSError as e:
+        print(f"file:{file_path},error:{e}")
+        return None
+
+
+def _hash_chunk(args):
+    file_paths, backend = args
+    return [_hash_one((file_path, backend)) for file_path in file_paths]
+
+
+def hash_files(file_paths: Sequence[str], backend: str = 'auto', pool: str = 'thread',
+               workers: Optional[int] = None, chunksize: int = 64, desc: Optional[str] = 'full hash') -> List[Optional[str]]:
+    '''
+    批量计算完整哈希
+    :param pool: thread 线程池(哈希计算时释放GIL, 适合大多数情况); process 进程池(CPU密集, 如文件都在页缓存里)
+    :param workers: 并发数, None则线程池为CPU核心数*2, 进程池为CPU核心数
+    :param desc: 进度条描述, None不显示进度条
+    :return: 与file_paths一一对应的哈希, 读取失败为None
+    '''
+    file_paths = list(file_paths)
+    if not file_paths:
+        return []
+    cpu_count = os.cpu_count() or 1
+    if pool == 'process':
+        workers = workers or cpu_count
+        chunks = [(file_paths[i:i + chunksize], backend) for i in range(0, len(file_paths), chunksize)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor, \
+                tqdm(total=len(file_paths), desc=desc, disable=desc is None) as pbar:
+            for part in executor.map(_hash_chunk, chunks):
+                results.extend(part)
+                pbar.update(len(part))
+        return results
+    if pool != 'thread':
+        raise ValueError(f'unknown pool {pool}, should be one of {POOLS}')
+    with ThreadPoolExecutor(max_workers=workers or cpu_count * 2) as executor:
+        return list(tqdm(executor.map(_hash_one, [(file_path, backend) for file_path in file_paths]),
+                         total=len(file_paths), desc=desc, disable=desc is None))
+
+
+def _drop_cache(file_path):
+    # 让内核丢掉这个文件的页缓存, 测速时每轮都从磁盘读
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        return True
+    except OSError:
+        return False
+
+
+def benchmark(root: str, limit: int = 500, cold: bool = True, workers: Optional[int] = None) -> Dict[str, float]:
+    '''
+    在目标磁盘上测试各backend和线程池/进程池的速度
+    :param root: 测试目录, 取其中最多limit个文件
+    :param cold: 每轮之前丢掉页缓存(仅Linux等支持posix_fadvise的系统), False则测的是页缓存命中时的速度
+    :return: {'backend/pool': MB/s}
+    '''
+    file_paths = []
+    total_bytes = 0
+    for path, st in iter_files(root):
+        file_paths.append(path)
+        total_bytes += st.st_size
+        if len(file_paths) >= limit:
+            break
+    print(f"benchmark: {len(file_paths)} files, {total_bytes / 1024 / 1024:.1f} MB, "
+          f"{'cold' if cold else 'warm'} cache")
+    results = {}
+    reference = None
+    for pool in POOLS:
+        for backend in BACKENDS + ['auto']:
+            if cold:
+                for path in file_paths:
+                    _drop_cache(path)
+            else:
+                hash_files(file_paths, 'read', 'thread', workers, desc=None)
+            start = time.time()
+            digests = hash_files(file_paths, backend, pool, workers, desc=None)
+            speed = total_bytes / 1024 / 1024 / max(time.time() - start, 1e-6)
+            if reference is None:
+                reference = digests
+            elif digests != reference:
+                print(f"warning: {backend}/{pool} gives different hashes")
+            results[f'{backend}/{pool}'] = speed
+            print(f"{backend + '/' + pool:>16}: {speed:8.1f} MB/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('root', help='directory on the disk to benchmark')
+    parser.add_argument('--limit', help='max files to read', type=int, default=500)
+    parser.add_argument('--warm', help='measure with files in page cache', action='store_true')
+    parser.add_argument('--workers', help='threads/processes, default by pool type', type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.root, args.limit, not args.warm, args.workers)
+
+
+if __name__ == '__main__':
+    main()
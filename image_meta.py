@@ -0,0 +1,242 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 16:30
+# @Author : Jovan
+# @File : image_meta.py
+# @desc : 图片元数据持久化缓存(宽高/通道/格式/大小/哈希), 按(路径, mtime, 大小)失效
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, NamedTuple, Optional
+
+import cache_db
+from hash_backend import hash_file, hash_files
+from image_size import ImageSize, get_image_size
+
+# 缓存攒够这么多条再写库
+FLUSH_SIZE = 1000
+# 采样哈希每段读取的字节数
+SAMPLE_BYTES = 4096
+
+
+class ImageMeta(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    width: Optional[int]
+    height: Optional[int]
+    channels: Optional[int]
+    format: Optional[str]
+    hash: Optional[str]
+    sample_hash: Optional[str]
+
+
+def full_hash(file_path, file_size=None):
+    '''
+    整个文件的blake2b哈希, 按文件大小选择读取方式
+    '''
+    return hash_file(file_path, file_size)
+
+
+def sample_hash(file_path, file_size=None):
+    '''
+    只读文件头/中段/尾部各4KB的blake2b哈希, 相同不代表文件一定相同
+    '''
+    size = os.path.getsize(file_path) if file_size is None else file_size
+    with open(file_path, 'rb') as f:
+        return sample_digest(f, size)
+
+
+def sample_digest(f, size, head=None):
+    '''
+    在已打开的文件上计算采样哈希, 结果同sample_hash
+    :param head: 已经读出的文件开头(至少SAMPLE_BYTES字节或整个文件), 不再重复读取
+    '''
+    hasher = hashlib.blake2b(digest_size=16)
+    # 文件开头
+    hasher.update(f.read(SAMPLE_BYTES) if head is None else head[:SAMPLE_BYTES])
+    # 文件中段（如果文件足够大）
+    if size > 2 * SAMPLE_BYTES:
+        f.seek(size // 2 - SAMPLE_BYTES // 2)
+        hasher.update(f.read(SAMPLE_BYTES))
+    # 文件末尾（如果文件足够大）
+    if size > 3 * SAMPLE_BYTES:
+        f.seek(-SAMPLE_BYTES, 2)
+        hasher.update(f.read(SAMPLE_BYTES))
+    return hasher.hexdigest()
+
+
+class ImageMetaStore:
+    """
+        图片元数据缓存, 文件的mtime或大小变化后对应记录自动失效
+        store = ImageMetaStore()
+        size = store.image_size(path)      # ImageSize or None
+        digest = store.content_hash(path)  # 整个文件的哈希
+        store.flush()
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_db.cache_path('image_meta.sqlite')
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._rows = {}
+        self._pending = {}
+        atexit.register(self.flush)
+
+    def _get_conn(self):
+        # 每个进程单独一个连接, 进程内多线程共用并由self._lock保护
+        if self._conn_pid != os.getpid():
+            self._conn_pid = os.getpid()
+            self._rows = {}
+            self._pending = {}
+            try:
+                self._conn = cache_db.connect(self.db_path, check_same_thread=False)
+                self._conn.execute('CREATE TABLE IF NOT EXISTS image_meta ('
+                                   'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                                   'width INTEGER, height INTEGER, channels INTEGER, format TEXT, '
+                                   'hash TEXT, sample_hash TEXT)')
+            except (OSError, sqlite3.Error) as e:
+                print(f"image meta cache disabled: {e}")
+                self._conn = None
+        return self._conn
+
+    def preload(self, root_dir):
+        '''
+        一次性把某个目录下的全部记录读进内存, 避免逐个文件查库
+        '''
+        prefix = os.path.join(os.path.abspath(root_dir), '')
+        with self._lock:
+            conn = self._get_conn()
+            if conn is None:
+                return 0
+            rows = conn.execute('SELECT * FROM image_meta WHERE path >= ? AND path < ?',
+                                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))).fetchall()
+            for row in rows:
+                self._rows[row[0]] = ImageMeta(*row)
+        return len(rows)
+
+    def _lookup(self, path, st):
+        key = os.path.abspath(path)
+        with self._lock:
+            meta = self._pending.get(key) or self._rows.get(key)
+            if meta is None:
+                conn = self._get_conn()
+                if conn is not None:
+                    try:
+                        row = conn.execute('SELECT * FROM image_meta WHERE path=?', (key,)).fetchone()
+                    except sqlite3.Error:
+                        row = None
+                    if row is not None:
+                        meta = ImageMeta(*row)
+                        self._rows[key] = meta
+        if meta is None or meta.size != st.st_size or meta.mtime_ns != st.st_mtime_ns:
+            meta = ImageMeta(key, st.st_size, st.st_mtime_ns, None, None, None, None, None, None)
+        return meta
+
+    def _store(self, meta):
+        with self._lock:
+            self._get_conn()
+            self._rows[meta.path] = meta
+            self._pending[meta.path] = meta
+            need_flush = len(self._pending) >= FLUSH_SIZE
+        if need_flush:
+            self.flush()
+
+    def get(self, path, st=None) -> ImageMeta:
+        '''
+        返回缓存中的记录, 文件改动过则各字段为None
+        '''
+        return self._lookup(path, st or os.stat(path))
+
+    def image_size(self, path, st=None) -> Optional[ImageSize]:
+        '''
+        获取图片尺寸, 缓存未命中时只读文件头(必要时解码)并写入缓存
+        '''
+        meta = self.get(path, st)
+        if meta.width is None:
+            size = get_image_size(path)
+            if size is None:
+                return None
+            meta = meta._replace(width=size.width, height=size.height,
+                                 channels=size.channels, format=size.format)
+            self._store(meta)
+        return ImageSize(meta.width, meta.height, meta.channels, meta.format)
+
+    def content_hash(self, path, st=None) -> str:
+        '''
+        整个文件的哈希, 缓存未命中时读全文件计算
+        '''
+        meta = self.get(path, st)
+        if meta.hash is None:
+            meta = meta._replace(hash=full_hash(path, meta.size))
+            self._store(meta)
+        return meta.hash
+
+    def content_hashes(self, paths, workers=None, pool='thread', stats=None) -> Dict[str, str]:
+        '''
+        批量获取整个文件的哈希, 缓存未命中的文件用hash_backend.hash_files一起计算
+        :param pool: thread 线程池; process 进程池
+        :param stats: {路径: os.stat_result}, 扫描时已有的stat结果, 不再重复stat
+        :return: {路径: 哈希}, 读取失败的文件不在结果里
+        '''
+        stats = stats or {}
+        result = {}
+        missing = []
+        for path in paths:
+            try:
+                meta = self.get(path, stats.get(path))
+            except OSError as e:
+                print(f"file:{path},error:{e}")
+                continue
+            if meta.hash is None:
+                missing.append((path, meta))
+            else:
+                result[path] = meta.hash
+        digests = hash_files([path for path, _ in missing], pool=pool, workers=workers)
+        for (path, meta), digest in zip(missing, digests):
+            if digest is not None:
+                result[path] = digest
+                self._store(meta._replace(hash=digest))
+        return result
+
+    def sample_hash(self, path, st=None) -> str:
+        '''
+        采样哈希, 缓存未命中时读头/中/尾计算
+        '''
+        meta = self.get(path, st)
+        if meta.sample_hash is None:
+            meta = meta._replace(sample_hash=sample_hash(path, meta.size))
+            self._store(meta)
+        return meta.sample_hash
+
+    def put(self, meta: ImageMeta):
+        '''
+        写入调用方自己算好的字段, meta一般来自get()再_replace
+        '''
+        self._store(meta)
+
+    def flush(self):
+        with self._lock:
+            conn = self._conn if self._conn_pid == os.getpid() else None
+            if conn is None or not self._pending:
+                return
+            try:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO image_meta VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     list(self._pending.values()))
+            except sqlite3.Error as e:
+                print(f"image meta cache write error: {e}")
+            self._pending.clear()
+
+
+_default_store = None
+
+
+def get_default_store() -> ImageMetaStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = ImageMetaStore()
+    return _default_store
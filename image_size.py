@@ -0,0 +1,179 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 15:20
+# @Author : Jovan
+# @File : image_size.py
+# @desc : 只读文件头获取图片宽高通道数(JPEG/PNG/BMP/GIF/WebP), 解析不了再用cv2/PIL解码
+import os
+import struct
+from typing import NamedTuple, Optional
+
+
+class ImageSize(NamedTuple):
+    width: int
+    height: int
+    channels: int
+    format: str
+
+
+# PNG color type -> 通道数, 与cv2.IMREAD_UNCHANGED读出来的一致
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 4, 6: 4}
+# 这几个marker不是SOF
+_JPEG_NOT_SOF = {0xC4, 0xC8, 0xCC}
+
+
+def _probe_jpeg(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        # 没有长度字段的marker
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) != 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if 0xC0 <= marker <= 0xCF and marker not in _JPEG_NOT_SOF:
+            data = f.read(6)
+            if len(data) != 6:
+                return None
+            _, height, width, components = struct.unpack('>BHHB', data)
+            return ImageSize(width, height, 1 if components == 1 else 3, 'jpeg')
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _probe_png(head):
+    if len(head) < 26 or head[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', head[16:24])
+    return ImageSize(width, height, _PNG_CHANNELS.get(head[25], 3), 'png')
+
+
+def _bmp_gray_palette(f, header_size, bpp):
+    # 8位及以下的BMP, 调色板全是灰度时cv2读出来是单通道
+    entry_size = 3 if header_size == 12 else 4
+    colors = 0
+    if header_size >= 40:
+        f.seek(46)
+        colors = struct.unpack('<I', f.read(4))[0]
+    colors = colors or (1 << bpp)
+    f.seek(14 + header_size)
+    palette = f.read(colors * entry_size)
+    if len(palette) != colors * entry_size:
+        return False
+    return all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette), entry_size))
+
+
+def _probe_bmp(f, head):
+    if len(head) < 26:
+        return None
+    header_size = struct.unpack('<I', head[14:18])[0]
+    if header_size == 12:
+        width, height, _, bpp = struct.unpack('<HHHH', head[18:26])
+    elif len(head) >= 30:
+        width, height, _, bpp = struct.unpack('<iiHH', head[18:30])
+    else:
+        return None
+    if bpp == 32:
+        channels = 4
+    elif bpp <= 8 and _bmp_gray_palette(f, header_size, bpp):
+        channels = 1
+    else:
+        channels = 3
+    return ImageSize(abs(width), abs(height), channels, 'bmp')
+
+
+def _probe_gif(head):
+    if len(head) < 10:
+        return None
+    width, height = struct.unpack('<HH', head[6:10])
+    return ImageSize(width, height, 3, 'gif')
+
+
+def _probe_webp(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and len(head) >= 30:
+        width, height = struct.unpack('<HH', head[26:30])
+        return ImageSize(width & 0x3fff, height & 0x3fff, 3, 'webp')
+    if chunk == b'VP8L' and len(head) >= 25:
+        b0, b1, b2, b3 = head[21:25]
+        width = 1 + (((b1 & 0x3f) << 8) | b0)
+        height = 1 + (((b3 & 0xf) << 10) | (b2 << 2) | ((b1 & 0xc0) >> 6))
+        alpha = (b3 >> 4) & 1
+        return ImageSize(width, height, 4 if alpha else 3, 'webp')
+    if chunk == b'VP8X' and len(head) >= 30:
+        alpha = head[20] & 0x10
+        width = 1 + int.from_bytes(head[24:27], 'little')
+        height = 1 + int.from_bytes(head[27:30], 'little')
+        return ImageSize(width, height, 4 if alpha else 3, 'webp')
+    return None
+
+
+def probe_image_header(image_path: str) -> Optional[ImageSize]:
+    '''
+    只解析文件头获取图片尺寸, 不支持的格式或文件头损坏返回None
+    :param image_path: 图片路径
+    :return: ImageSize(width, height, channels, format)
+    '''
+    with open(image_path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\xff\xd8'):
+            return _probe_jpeg(f)
+        if head.startswith(b'BM'):
+            return _probe_bmp(f, head)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return _probe_png(head)
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return _probe_gif(head)
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return _probe_webp(head)
+    return None
+
+
+def decode_image_size(image_path: str) -> Optional[ImageSize]:
+    '''
+    解码整张图片获取尺寸, 先cv2后PIL
+    '''
+    try:
+        import cv2
+        import numpy as np
+        # imdecode+fromfile 支持中文路径
+        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8),
+                           cv2.IMREAD_UNCHANGED | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is not None:
+            h, w = img.shape[:2]
+            channels = img.shape[2] if len(img.shape) > 2 else 1
+            return ImageSize(w, h, channels, os.path.splitext(image_path)[-1].lstrip('.').lower())
+    except ImportError:
+        pass
+
+    try:
+        from PIL import Image
+        with Image.open(image_path) as img:
+            return ImageSize(img.width, img.height, len(img.getbands()), (img.format or '').lower())
+    except (ImportError, OSError):
+        pass
+    return None
+
+
+def get_image_size(image_path: str, fallback: bool = True) -> Optional[ImageSize]:
+    '''
+    获取图片尺寸, 优先只读文件头, 读不出来再解码
+    :param image_path: 图片路径
+    :param fallback: 文件头解析失败时是否用cv2/PIL解码
+    :return: ImageSize(width, height, channels, format), 获取失败返回None
+    '''
+    try:
+        size = probe_image_header(image_path)
+    except (OSError, struct.error):
+        size = None
+    if size is None and fallback:
+        size = decode_image_size(image_path)
+    return size
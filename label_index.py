@@ -0,0 +1,137 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 21:20
+# @Author : Jovan
+# @File : label_index.py
+# @desc : 每个xml只取object下的<name>, 多进程构建并缓存到sqlite, 文件mtime或大小变化后重新解析
+import io
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from lxml import etree
+from tqdm import tqdm
+
+import cache_db
+from xml_encoding import flush_encoding_cache, read_xml_bytes
+
+
+def read_xml_labels(xml_path: str) -> List[str]:
+    '''
+    流式读取xml中每个object的name, 不构建VocAnnotation
+    :param xml_path: xml路径
+    :return: 按object顺序的类别名列表
+    '''
+    data, encoding = read_xml_bytes(xml_path)
+    labels = []
+    for _, elem in etree.iterparse(io.BytesIO(data), tag='name', encoding=encoding):
+        parent = elem.getparent()
+        if parent is not None and parent.tag == 'object':
+            labels.append(elem.text)
+    return labels
+
+
+def _read_chunk(xml_paths):
+    results = []
+    for xml_path in xml_paths:
+        try:
+            results.append(read_xml_labels(xml_path))
+        except Exception as e:
+            print(f"file:{xml_path},error:{e}")
+            results.append(None)
+    flush_encoding_cache()
+    return results
+
+
+def _iter_chunks(chunks, workers):
+    if workers <= 1 or len(chunks) <= 1:
+        yield from map(_read_chunk, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_read_chunk, chunks)
+
+
+class LabelIndex:
+    """
+        xml -> 类别名列表 的缓存索引
+        index = LabelIndex()
+        labels = index.build(xml_paths)   # {xml路径: [name, ...] or None}
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_db.cache_path('label_index.sqlite')
+        try:
+            self.conn = cache_db.connect(self.db_path)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS label_index ('
+                              'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, labels TEXT)')
+        except (OSError, sqlite3.Error) as e:
+            print(f"label index cache disabled: {e}")
+            self.conn = None
+
+    def _load_dir(self, dir_path):
+        prefix = os.path.join(dir_path, '')
+        rows = self.conn.execute('SELECT path, mtime_ns, size, labels FROM label_index WHERE path >= ? AND path < ?',
+                                 (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        return {row[0]: row[1:] for row in rows}
+
+    def build(self, xml_paths: Iterable[str], workers: Optional[int] = None,
+              chunksize: int = 512) -> Dict[str, Optional[List[str]]]:
+        '''
+        获取每个xml的类别名列表, 只解析缓存中没有或已修改的xml
+        :param xml_paths: xml路径列表
+        :param workers: 进程数, None则使用CPU核心数, 1为单进程
+        :param chunksize: 每个任务包含的xml数量
+        :return: {xml路径: 类别名列表}, 按输入顺序, 解析失败为None
+        '''
+        xml_paths = list(xml_paths)
+        rows = {}
+        if self.conn is not None:
+            for dir_path in {os.path.dirname(os.path.abspath(path)) for path in xml_paths}:
+                rows.update(self._load_dir(dir_path))
+
+        index = {}
+        missing = []
+        stats = {}
+        for xml_path in xml_paths:
+            key = os.path.abspath(xml_path)
+            try:
+                st = os.stat(xml_path)
+            except OSError:
+                missing.append(xml_path)
+                continue
+            stats[xml_path] = st
+            row = rows.get(key)
+            if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+                index[xml_path] = json.loads(row[2])
+            else:
+                missing.append(xml_path)
+
+        workers = workers or os.cpu_count() or 1
+        chunks = [missing[i:i + chunksize] for i in range(0, len(missing), chunksize)]
+        updates = []
+        with tqdm(total=len(missing), desc='label index') as pbar:
+            for chunk, part in zip(chunks, _iter_chunks(chunks, workers)):
+                for xml_path, labels in zip(chunk, part):
+                    index[xml_path] = labels
+                    if labels is not None and xml_path in stats:
+                        st = stats[xml_path]
+                        updates.append((os.path.abspath(xml_path), st.st_mtime_ns, st.st_size,
+                                        json.dumps(labels, ensure_ascii=False)))
+                pbar.update(len(part))
+
+        if updates and self.conn is not None:
+            try:
+                with self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO label_index VALUES (?, ?, ?, ?)', updates)
+            except sqlite3.Error as e:
+                print(f"label index cache write error: {e}")
+        return {xml_path: index[xml_path] for xml_path in xml_paths}
+
+
+def build_label_index(xml_paths: Iterable[str], **kwargs) -> Dict[str, Optional[List[str]]]:
+    '''
+    同LabelIndex().build, 使用默认缓存位置
+    '''
+    return LabelIndex().build(xml_paths, **kwargs)
@@ -0,0 +1,208 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 23:20
+# @Author : Jovan
+# @File : perceptual_hash.py
+# @desc : 图片感知哈希(pHash/dHash), 多进程缩小解码计算, 多索引哈希查找汉明距离内的近似重复图片
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+# 缩小解码后短边小于这个值时重新按原尺寸解码
+MIN_DECODE_SIDE = 64
+# 估算分段方案时, 每个哈希一次排序分组相对于一次组内比较的开销(按200万随机哈希实测)
+SORT_COST = 4
+
+
+def load_gray_small(image_path: str) -> Optional[np.ndarray]:
+    '''
+    读取缩小的灰度图, JPEG直接在解码时缩小到1/8, 比完整解码快得多
+    :return: 灰度图, 读取失败返回None
+    '''
+    # imdecode+fromfile 支持中文路径
+    data = np.fromfile(image_path, dtype=np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None or min(img.shape[:2]) < MIN_DECODE_SIDE:
+        img = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    return img
+
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def phash(gray: np.ndarray) -> int:
+    '''
+    缩放到32x32做DCT, 取左上8x8低频系数与中位数比较, 64位
+    '''
+    img = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(img)[:8, :8]
+    return _pack_bits(low > np.median(low))
+
+
+def dhash(gray: np.ndarray) -> int:
+    '''
+    缩放到9x8, 每行相邻像素比较, 64位
+    '''
+    img = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _pack_bits(img[:, 1:] > img[:, :-1])
+
+
+def image_hashes(image_path: str) -> Optional[Tuple[int, int]]:
+    '''
+    :return: (phash, dhash), 解码失败返回None
+    '''
+    gray = load_gray_small(image_path)
+    if gray is None:
+        return None
+    return phash(gray), dhash(gray)
+
+
+def _hash_chunk(image_paths):
+    results = []
+    for image_path in image_paths:
+        try:
+            results.append(image_hashes(image_path))
+        except Exception as e:
+            print(f"file:{image_path},error:{e}")
+            results.append(None)
+    return results
+
+
+def _iter_chunks(chunks, workers):
+    if workers <= 1 or len(chunks) <= 1:
+        yield from map(_hash_chunk, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_hash_chunk, chunks)
+
+
+def compute_hashes(image_paths: Sequence[str], workers: Optional[int] = None, chunksize: int = 256,
+                   desc: str = 'perceptual hash') -> List[Optional[Tuple[int, int]]]:
+    '''
+    多进程计算感知哈希
+    :param workers: 进程数, None则使用CPU核心数, 1为单进程
+    :return: 与image_paths一一对应的(phash, dhash), 解码失败为None
+    '''
+    image_paths = list(image_paths)
+    chunks = [image_paths[i:i + chunksize] for i in range(0, len(image_paths), chunksize)]
+    workers = workers or os.cpu_count() or 1
+    results = []
+    with tqdm(total=len(image_paths), desc=desc) as pbar:
+        for part in _iter_chunks(chunks, workers):
+            results.extend(part)
+            pbar.update(len(part))
+    return results
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+# 每个字节的1的个数, numpy没有bitwise_count时使用
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    '''
+    uint64数组每个元素的1的个数
+    '''
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    return _BYTE_POPCOUNT[values.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def _segment_plan(n, max_distance):
+    '''
+    选择分段数m: 距离不超过r的两个哈希分成m段后, 至少有一段的距离不超过r // m.
+    每段枚举r // m个忽略的位再分组, 估算 分组次数 * (排序 + 组内比较) 最小的m
+    '''
+    best = None
+    for segments in range(1, max_distance + 2):
+        bits = 64 // segments
+        sub_radius = max_distance // segments
+        if sub_radius >= bits:
+            continue
+        passes = segments * math.comb(bits, sub_radius)
+        cost = passes * (SORT_COST + n / 2 ** (bits - sub_radius))
+        if best is None or cost < best[0]:
+            best = (cost, segments, sub_radius)
+    return best[1], best[2]
+
+
+def near_duplicate_pairs(hashes: Sequence[int], max_distance: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    多索引哈希: 64位分成m段, 汉明距离不超过r的两个哈希至少有一段的距离不超过r // m,
+    每段每次忽略r // m个位后排序分组, 只在组内计算完整距离
+    :param hashes: 64位哈希
+    :param max_distance: 最大汉明距离r, 0~63
+    :return: (i, j) 距离不超过max_distance的下标对, i < j, 每对只出现一次
+    '''
+    if not 0 <= max_distance < 64:
+        raise ValueError(f'max_distance should be in [0, 64), got {max_distance}')
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    segments, sub_radius = _segment_plan(n, max_distance)
+    bounds = np.linspace(0, 64, segments + 1).astype(np.int64).tolist()
+    found_i, found_j = [], []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segment = (hashes >> np.uint64(start)) & np.uint64((1 << (end - start)) - 1)
+        for ignored in itertools.combinations(range(end - start), sub_radius):
+            keep = (1 << (end - start)) - 1 - sum(1 << bit for bit in ignored)
+            key = segment & np.uint64(keep)
+            order = np.argsort(key)
+            key = key[order]
+            # 排序后同一组连续, 逐步比较相隔offset的位置, 不同组后更远的位置也不同
+            active = np.flatnonzero(key[:-1] == key[1:])
+            offset = 1
+            while len(active):
+                a, b = order[active], order[active + offset]
+                close = popcount64(hashes[a] ^ hashes[b]) <= max_distance
+                found_i.append(np.minimum(a[close], b[close]))
+                found_j.append(np.maximum(a[close], b[close]))
+                offset += 1
+                active = active[active + offset < n]
+                active = active[key[active] == key[active + offset]]
+    if not found_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    # 同一对可能在多段、多次分组里都出现
+    keys = np.unique(np.concatenate(found_i).astype(np.int64) * n + np.concatenate(found_j))
+    return keys // n, keys % n
+
+
+def cluster_near_duplicates(hashes: Sequence[int], max_distance: int) -> List[List[int]]:
+    '''
+    把汉明距离不超过max_distance的图片连成一组(传递闭包, a与b近似、b与c近似则a、b、c同组)
+    :param hashes: 每张图片的64位哈希
+    :return: 每组图片的下标(升序), 只返回多于一张的组, 按组内最小下标排序
+    '''
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if not len(hashes):
+        return []
+    # 相同哈希先合并, 避免大量完全相同的图片两两比较
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    parent = list(range(len(unique)))
+
+    def _find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(*(arr.tolist() for arr in near_duplicate_pairs(unique, max_distance))):
+        root_a, root_b = _find(a), _find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = {}
+    for index, unique_index in enumerate(inverse.reshape(-1).tolist()):
+        groups.setdefault(_find(unique_index), []).append(index)
+    return sorted((group for group in groups.values() if len(group) > 1), key=lambda group: group[0])
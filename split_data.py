@@ -1,13 +1,9 @@
 import os
 import glob
 import random
-from lxml import etree
 
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as f:
-        raw_data = f.read()
-        result = chardet.detect(raw_data)
-        return result['encoding']
+from label_index import build_label_index
+from split_engine import group_keys, split_class_counts, stratified_split
 
 
 config = {
@@ -15,49 +11,63 @@ config = {
     "JPEGImages": "JPEGImages",
 }
 
-train_per = 0.88
-valid_per = 0.1
-test_per = 0.02
-
-data_xml_list = glob.glob(os.path.join(config['Annotation'], '*.xml'))
-random.seed(666)
-random.shuffle(data_xml_list)
-data_length = len(data_xml_list)
-
-train_point = int(data_length * train_per)
-train_valid_point = int(data_length * (train_per + valid_per))
-
-train_list = data_xml_list[:train_point]
-valid_list = data_xml_list[train_point:train_valid_point]
-test_list = data_xml_list[train_valid_point:]
-
-label = set()
-for xml_path in data_xml_list:
-    try:
-        encoding = detect_encoding(xml_path)
-        tree1 = etree.parse(xml_path, parser=etree.XMLParser(encoding=encoding))
-        tree = tree1.getroot()
-    except Exception as e:
-        print(xml_path)
-        print(f"Error: {e}")
-
-    for obj in tree.findall('object'):
-        label.add(obj.find('name').text)
-
-with open('ImageSets/Main/train.txt', 'w') as ftrain, \
-     open('ImageSets/Main/val.txt', 'w') as fvalid, \
-     open('ImageSets/Main/test.txt', 'w') as ftest, \
-     open('label.txt', 'w') as flabel:
-    for i in train_list:
-        ftrain.write(os.path.splitext(os.path.basename(i))[0] + "\n")
-    for j in valid_list:
-        fvalid.write(os.path.splitext(os.path.basename(j))[0] + "\n")
-    for k in test_list:
-        ftest.write(os.path.splitext(os.path.basename(k))[0] + "\n")
-    for l in label:
-        flabel.write(l + "\n")
-
-print(f"总数据量: {data_length}, 训练集: {len(train_list)}, 验证集: {len(valid_list)}, 测试集: {len(test_list)}, 标签: {len(label)}")
-print(f"标签: {label}")
-print("done!")
 
+def main():
+    train_per = 0.88
+    valid_per = 0.1
+    test_per = 0.02
+    # 切分方式: random 随机切分; stratified 按每张图的类别迭代分层, 稀有类别也按比例分到各个划分
+    split_method = 'random'
+    # 分组正则, 同组图片分到同一个划分(比如同一段视频的帧), 例如 r'^(.+)_frame\d+$', None则不分组
+    group_pattern = None
+
+    data_xml_list = glob.glob(os.path.join(config['Annotation'], '*.xml'))
+    random.seed(666)
+    random.shuffle(data_xml_list)
+    data_length = len(data_xml_list)
+
+    # 只读取每个xml中object的name, 结果缓存, 下次只解析有变化的xml
+    label_index = build_label_index(data_xml_list)
+    label = set()
+    for labels in label_index.values():
+        if labels is None:
+            continue
+        label.update(labels)
+
+    if split_method == 'random' and group_pattern is None:
+        train_point = int(data_length * train_per)
+        train_valid_point = int(data_length * (train_per + valid_per))
+
+        train_list = data_xml_list[:train_point]
+        valid_list = data_xml_list[train_point:train_valid_point]
+        test_list = data_xml_list[train_valid_point:]
+    else:
+        label_lists = [label_index[i] for i in data_xml_list] if split_method == 'stratified' else None
+        image_split = stratified_split(label_lists, [train_per, valid_per, test_per],
+                                       groups=group_keys(data_xml_list, group_pattern), seed=666)
+        train_list, valid_list, test_list = [[i for i, s in zip(data_xml_list, image_split) if s == n]
+                                             for n in range(3)]
+        if label_lists is not None:
+            for name, count in zip(['train', 'val', 'test'], split_class_counts(label_lists, image_split, 3)):
+                print(f"{name}: {count}")
+
+    with open('ImageSets/Main/train.txt', 'w') as ftrain, \
+         open('ImageSets/Main/val.txt', 'w') as fvalid, \
+         open('ImageSets/Main/test.txt', 'w') as ftest, \
+         open('label.txt', 'w') as flabel:
+        for i in train_list:
+            ftrain.write(os.path.splitext(os.path.basename(i))[0] + "\n")
+        for j in valid_list:
+            fvalid.write(os.path.splitext(os.path.basename(j))[0] + "\n")
+        for k in test_list:
+            ftest.write(os.path.splitext(os.path.basename(k))[0] + "\n")
+        for l in label:
+            flabel.write(l + "\n")
+
+    print(f"总数据量: {data_length}, 训练集: {len(train_list)}, 验证集: {len(valid_list)}, 测试集: {len(test_list)}, 标签: {len(label)}")
+    print(f"标签: {label}")
+    print("done!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 21:50
+# @Author : Jovan
+# @File : split_engine.py
+# @desc : 按类别分层(迭代分层)、按分组切分数据集, NumPy向量化, 百万级图片秒级完成
+import os
+import re
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def group_keys(paths: Sequence[str], pattern: Optional[str] = None) -> Optional[List[str]]:
+    '''
+    根据文件名得到分组, 同一分组的图片会被分到同一个划分里(比如同一段视频的帧)
+    :param paths: 文件路径
+    :param pattern: 匹配文件名(不含后缀)的正则, 有捕获组时取第一个捕获组, 否则取整个匹配; 匹配不上的文件单独成组
+                    例如 r'^(.+)_frame\\d+$' 把 videoA_frame0001 分到 videoA 组
+    :return: 每个文件的分组名, pattern为None时返回None
+    '''
+    if pattern is None:
+        return None
+    regex = re.compile(pattern)
+    keys = []
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        match = regex.search(stem)
+        if match is None:
+            keys.append(stem)
+        else:
+            keys.append(match.group(1) if regex.groups else match.group(0))
+    return keys
+
+
+def _quota_assign(weights, demand, rng):
+    # 随机打乱后按累计权重落到各划分的剩余需求区间里
+    order = rng.permutation(len(weights))
+    weights = weights[order]
+    total = weights.sum()
+    if demand.sum() <= 0 or total <= 0:
+        return order, np.zeros(len(weights), dtype=np.int64)
+    bounds = np.cumsum(demand) / demand.sum() * total
+    mids = np.cumsum(weights) - weights / 2.0
+    splits = np.searchsorted(bounds, mids, side='right')
+    return order, np.minimum(splits, len(demand) - 1)
+
+
+def stratified_split(label_lists: Optional[Sequence[Optional[Sequence[str]]]],
+                     ratios: Sequence[float],
+                     groups: Optional[Sequence[str]] = None,
+                     seed: int = 666) -> np.ndarray:
+    '''
+    迭代分层切分: 从最稀有的类别开始, 把含该类别且还没分配的图片(或分组)按各划分对该类别的剩余需求分配,
+    没有目标的图片最后按各划分剩余的图片数分配
+    :param label_lists: 每张图片的类别名列表(可重复, 按目标计数), None则只按分组随机切分
+    :param ratios: 各划分比例, 如[0.88, 0.1, 0.02], 比例为0的划分不会分到图片
+    :param groups: 每张图片的分组名, 同组图片分到同一个划分
+    :param seed: 随机种子
+    :return: 每张图片所属划分的下标, int64数组
+    '''
+    rng = np.random.default_rng(seed)
+    ratios = np.asarray(ratios, dtype=np.float64)
+    ratios = ratios / ratios.sum()
+    n_splits = len(ratios)
+    n_images = len(label_lists) if label_lists is not None else len(groups)
+
+    # 图片 -> 单元(分组), 没有分组时每张图片一个单元
+    if groups is not None:
+        _, image_unit = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+        image_unit = image_unit.reshape(-1)
+    else:
+        image_unit = np.arange(n_images)
+    n_units = int(image_unit.max()) + 1 if n_images else 0
+    unit_size = np.bincount(image_unit, minlength=n_units).astype(np.float64)
+    unit_split = np.full(n_units, -1, dtype=np.int64)
+
+    if label_lists is not None:
+        class_map = {}
+        entry_image = []
+        entry_class = []
+        for image_idx, labels in enumerate(label_lists):
+            for label in labels or ():
+                entry_image.append(image_idx)
+                entry_class.append(class_map.setdefault(label, len(class_map)))
+        n_classes = len(class_map)
+        if entry_image:
+            # (单元, 类别) -> 目标数, 按类别排序后每个类别是一段连续区间
+            keys = image_unit[np.asarray(entry_image)] * n_classes + np.asarray(entry_class)
+            keys, counts = np.unique(keys, return_counts=True)
+            entry_unit, entry_class = np.divmod(keys, n_classes)
+            order = np.argsort(entry_class, kind='stable')
+            entry_unit, entry_class, counts = entry_unit[order], entry_class[order], counts[order].astype(np.float64)
+            class_start = np.searchsorted(entry_class, np.arange(n_classes + 1))
+            class_total = np.diff(np.concatenate([[0], np.cumsum(counts)])[class_start])
+            for cls in np.argsort(class_total, kind='stable'):
+                start, end = class_start[cls], class_start[cls + 1]
+                units, weights = entry_unit[start:end], counts[start:end]
+                assigned = unit_split[units]
+                done = assigned >= 0
+                current = np.bincount(assigned[done], weights=weights[done], minlength=n_splits)
+                demand = np.maximum(ratios * class_total[cls] - current, 0)
+                if not done.all():
+                    todo = ~done
+                    order, splits = _quota_assign(weights[todo], demand if demand.sum() > 0 else ratios, rng)
+                    unit_split[units[todo][order]] = splits
+
+    # 没有目标(或没有给类别)的单元按图片数补齐
+    todo = np.flatnonzero(unit_split < 0)
+    if len(todo):
+        done = unit_split >= 0
+        current = np.bincount(unit_split[done], weights=unit_size[done], minlength=n_splits)
+        demand = np.maximum(ratios * n_images - current, 0)
+        order, splits = _quota_assign(unit_size[todo], demand if demand.sum() > 0 else ratios, rng)
+        unit_split[todo[order]] = splits
+    return unit_split[image_unit]
+
+
+def split_class_counts(label_lists, image_split, n_splits):
+    '''
+    统计每个划分中各类别的目标数, 用于检查分层效果
+    :return: [{类别名: 数量}, ...]
+    '''
+    result = [{} for _ in range(n_splits)]
+    for labels, split in zip(label_lists, image_split):
+        count = result[split]
+        for label in labels or ():
+            count[label] = count.get(label, 0) + 1
+    return result
@@ -0,0 +1,105 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 19:10
+# @Author : Jovan
+# @File : stage_file.py
+# @desc : 把文件放到目标目录, 支持复制/硬链接/软链接/reflink, 链接失败时退回复制, 未变化的文件跳过
+import errno
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+STAGE_MODES = ['copy', 'hardlink', 'symlink', 'reflink']
+# linux/fs.h 中的 FICLONE, btrfs/xfs 等支持写时复制的文件系统上可以共享数据块
+FICLONE = 0x40049409
+
+
+def _copy_file_range(src, dst):
+    # 内核内拷贝, 部分文件系统上同样只共享数据块
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remain = os.fstat(fsrc.fileno()).st_size
+        while remain > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remain)
+            if copied == 0:
+                break
+            remain -= copied
+
+
+def reflink(src, dst):
+    '''
+    写时复制, FICLONE不支持时尝试copy_file_range, 都不支持(如Windows)时抛出OSError
+    '''
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (OSError, ImportError) as e:
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError(errno.EOPNOTSUPP, f'reflink not supported: {e}') from e
+        _copy_file_range(src, dst)
+
+
+def is_unchanged(src, dst, src_stat=None):
+    '''
+    dst与src大小和修改时间都相同时认为不需要重新放置
+    '''
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    src_stat = src_stat or os.stat(src)
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def stage_file(src, dst, mode='copy', skip_unchanged=False):
+    '''
+    把src放到dst, dst已存在时覆盖
+    :param mode: copy 复制; hardlink 硬链接(需同一文件系统); symlink 指向src绝对路径的软链接;
+                 reflink 写时复制(需文件系统支持)
+    :param skip_unchanged: dst大小和修改时间与src相同时跳过
+    :return: 实际使用的方式, 链接失败退回复制时返回'copy', 跳过时返回'skip'
+    '''
+    src_stat = os.stat(src)
+    if skip_unchanged and is_unchanged(src, dst, src_stat):
+        return 'skip'
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return mode
+        if mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+        if mode == 'reflink':
+            reflink(src, dst)
+            os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+            return mode
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    # 保留修改时间, 下次运行时才能判断出未变化
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return 'copy'
+
+
+def stage_dir(src_dir, dst_dir, mode='copy', workers=None, skip_unchanged=True):
+    '''
+    把src_dir下的全部文件(不含子目录)放到dst_dir, 多线程并发
+    :param workers: 线程数, None则为min(32, CPU核心数*4)
+    :return: Counter, 各方式处理的文件数, 如{'hardlink': 10, 'skip': 90}
+    '''
+    os.makedirs(dst_dir, exist_ok=True)
+    with os.scandir(src_dir) as it:
+        names = [entry.name for entry in it if entry.is_file()]
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    counter = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(stage_file, os.path.join(src_dir, name), os.path.join(dst_dir, name),
+                                   mode, skip_unchanged) for name in names]
+        for future in tqdm(futures, desc='stage', unit='file'):
+            counter[future.result()] += 1
+    return counter
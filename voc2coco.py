@@ -1,19 +1,12 @@
 import os
 import argparse
-import json
 from typing import Dict, List
-from lxml import etree
 
-from tqdm import tqdm
 import re
-import chardet
 
-
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as f:
-        raw_data = f.read()
-        result = chardet.detect(raw_data)
-        return result['encoding']
+from coco_writer import CocoJsonWriter
+from voc_manifest import VocManifest
+from voc_parser import iter_voc_xmls
 
 
 def get_label2id(labels_path: str) -> Dict[str, int]:
@@ -46,21 +39,20 @@ def get_annpaths(ann_dir_path: str = None,
     return ann_paths
 
 
-def get_image_info(annotation_root,file_name, extract_num_from_imgid=True):
-    path = annotation_root.findtext('path')
+def get_image_info(annotation, extract_num_from_imgid=True):
+    path = annotation.path
     if path is None:
-        filename = annotation_root.findtext('filename')
+        filename = annotation.filename
     else:
         filename = os.path.basename(path)
-    filename = os.path.splitext(os.path.basename(file_name))[0]+os.path.splitext(filename)[-1]
+    filename = os.path.splitext(os.path.basename(annotation.xml_path))[0]+os.path.splitext(filename)[-1]
     img_name = os.path.basename(filename)
     img_id = os.path.splitext(img_name)[0]
     if extract_num_from_imgid and isinstance(img_id, str):
         img_id = int(re.findall(r'\d+', img_id)[0])
 
-    size = annotation_root.find('size')
-    width = int(size.findtext('width'))
-    height = int(size.findtext('height'))
+    width = int(annotation.width)
+    height = int(annotation.height)
 
     image_info = {
         'file_name': filename,
@@ -72,14 +64,13 @@ def get_image_info(annotation_root,file_name, extract_num_from_imgid=True):
 
 
 def get_coco_annotation_from_obj(obj, label2id):
-    label = obj.findtext('name')
+    label = obj.name
     assert label in label2id, f"Error: {label} is not in label2id !"
     category_id = label2id[label]
-    bndbox = obj.find('bndbox')
-    xmin = int(float(bndbox.findtext('xmin'))) - 1
-    ymin = int(float(bndbox.findtext('ymin'))) - 1
-    xmax = int(float(bndbox.findtext('xmax')))
-    ymax = int(float(bndbox.findtext('ymax')))
+    xmin = int(obj.xmin) - 1
+    ymin = int(obj.ymin) - 1
+    xmax = int(obj.xmax)
+    ymax = int(obj.ymax)
     assert xmax > xmin and ymax > ymin, f"Box size error !: (xmin, ymin, xmax, ymax): {xmin, ymin, xmax, ymax}"
     o_width = xmax - xmin
     o_height = ymax - ymin
@@ -97,46 +88,50 @@ def get_coco_annotation_from_obj(obj, label2id):
 def convert_xmls_to_cocojson(annotation_paths: List[str],
                              label2id: Dict[str, int],
                              output_jsonpath: str,
-                             extract_num_from_imgid: bool = True):
-    output_json_dict = {
-        "images": [],
-        "type": "instances",
-        "annotations": [],
-        "categories": []
-    }
+                             extract_num_from_imgid: bool = True,
+                             workers: int = None,
+                             incremental: bool = False):
     bnd_id = 1  # START_BOUNDING_BOX_ID, TODO input as args ?
     print('Start converting !')
-    for a_path in tqdm(annotation_paths):
-        # Read annotation xml
-        try:
-            encoding = detect_encoding(a_path)
-            ann_tree = etree.parse(a_path, parser=etree.XMLParser(encoding=encoding))
-            ann_root = ann_tree.getroot()
-        except Exception as e:
-            print(f"file:{a_path},error:{e}")
-            continue
-        # ann_tree = ET.parse(a_path)
-        # ann_root = ann_tree.getroot()
-
-        img_info = get_image_info(annotation_root=ann_root,file_name=a_path,
-                                  extract_num_from_imgid=extract_num_from_imgid)
-        img_id = img_info['id']
-        output_json_dict['images'].append(img_info)
-
-        for obj in ann_root.findall('object'):
-            ann = get_coco_annotation_from_obj(obj=obj, label2id=label2id)
-            ann.update({'image_id': img_id, 'id': bnd_id})
-            output_json_dict['annotations'].append(ann)
-            bnd_id = bnd_id + 1
-
-    for label, label_id in label2id.items():
-        category_info = {'supercategory': 'none', 'id': label_id, 'name': label}
-        output_json_dict['categories'].append(category_info)
-    if os.path.exists(output_jsonpath):
-        os.remove(output_jsonpath)
-    with open(output_jsonpath, 'w') as f:
-        output_json = json.dumps(output_json_dict)
-        f.write(output_json)
+    manifest = None
+    if incremental:
+        # 只解析新增/修改的xml, 其余用清单里上次的解析结果重新生成json
+        manifest = VocManifest('voc2coco', output_jsonpath,
+                               config=[label2id, extract_num_from_imgid])
+        cached, changed, deleted = manifest.sync(annotation_paths, workers=workers)
+        if not changed and not deleted and os.path.exists(output_jsonpath):
+            manifest.commit()
+            manifest.close()
+            print('Nothing changed !')
+            return
+        annotations = (cached[path] for path in annotation_paths)
+    else:
+        # 多进程解析全部xml, 解析失败的文件为None
+        annotations = iter_voc_xmls(annotation_paths, workers=workers)
+    # 边解析边写出, images和annotations不在内存中累积
+    with CocoJsonWriter(output_jsonpath) as writer:
+        for annotation in annotations:
+            if annotation is None:
+                continue
+
+            img_info = get_image_info(annotation=annotation,
+                                      extract_num_from_imgid=extract_num_from_imgid)
+            img_id = img_info['id']
+            writer.add_image(img_info)
+
+            for obj in annotation.objects:
+                ann = get_coco_annotation_from_obj(obj=obj, label2id=label2id)
+                ann.update({'image_id': img_id, 'id': bnd_id})
+                writer.add_annotation(ann)
+                bnd_id = bnd_id + 1
+
+        for label, label_id in label2id.items():
+            category_info = {'supercategory': 'none', 'id': label_id, 'name': label}
+            writer.add_category(category_info)
+    if manifest is not None:
+        # json写完并替换后才更新清单, 转换中途失败时下次仍会重新转换这些xml
+        manifest.commit()
+        manifest.close()
 
 
 def main():
@@ -157,6 +152,10 @@ def main():
     parser.add_argument('--ext', type=str, default='xml', help='additional extension of annotation file')
     parser.add_argument('--extract_num_from_imgid', action="store_true",
                         help='Extract image number from the image filename')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes used to parse xml, default is cpu count')
+    parser.add_argument('--incremental', action="store_true",
+                        help='Only parse new or modified xmls since the last run with the same output')
     args = parser.parse_args()
     label2id = get_label2id(labels_path=args.labels)
     ann_paths = get_annpaths(
@@ -169,7 +168,9 @@ def main():
         annotation_paths=ann_paths,
         label2id=label2id,
         output_jsonpath=args.output,
-        extract_num_from_imgid=args.extract_num_from_imgid
+        extract_num_from_imgid=args.extract_num_from_imgid,
+        workers=args.workers,
+        incremental=args.incremental
     )
 
 
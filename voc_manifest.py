@@ -0,0 +1,139 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 20:40
+# @Author : Jovan
+# @File : voc_manifest.py
+# @desc : 增量转换清单, 记录每个xml的(路径, mtime, 大小, 哈希)和解析结果, 只重新解析新增/修改的xml
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import cache_db
+from image_meta import full_hash
+from voc_parser import VocAnnotation, VocObject, parse_voc_xmls
+
+
+def _dump_annotation(annotation):
+    return json.dumps([annotation.xml_path, annotation.filename, annotation.path, annotation.width,
+                       annotation.height, annotation.depth, [list(obj) for obj in annotation.objects]],
+                      ensure_ascii=False)
+
+
+def _load_annotation(text, xml_path):
+    _, filename, path, width, height, depth, objects = json.loads(text)
+    # xml_path用本次传入的写法, 与直接解析时一致
+    return VocAnnotation(xml_path, filename, path, width, height, depth,
+                         tuple(VocObject(*obj) for obj in objects))
+
+
+class VocManifest:
+    """
+        一个转换任务(比如某个输出目录/输出json)的增量清单, 按输出路径区分不同任务
+        manifest = VocManifest('voc2coco', output_path, config=label2id)
+        annotations, changed, deleted = manifest.sync(xml_paths)
+        ...                                # 写出转换结果
+        manifest.commit()                  # 输出写完后再更新清单, 中途失败时下次仍会重新转换
+    """
+
+    def __init__(self, name, output_path, config=None, db_path=None):
+        '''
+        :param name: 工具名
+        :param output_path: 输出路径, 与name一起确定任务
+        :param config: 影响输出的配置(比如类别列表), 变化后整个任务重新转换
+        '''
+        self.task = f'{name}:{os.path.abspath(output_path)}'
+        self.config = json.dumps(config, ensure_ascii=False, sort_keys=True)
+        self.db_path = db_path or cache_db.cache_path('voc_manifest.sqlite')
+        self.conn = cache_db.connect(self.db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS voc_task (task TEXT PRIMARY KEY, config TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS voc_manifest ('
+                          'task TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, hash TEXT, annotation TEXT, '
+                          'PRIMARY KEY (task, path))')
+        self._pending = None
+
+    def _load_rows(self):
+        # 配置变化时返回None, 整个任务重新转换
+        row = self.conn.execute('SELECT config FROM voc_task WHERE task=?', (self.task,)).fetchone()
+        if row is None or row[0] != self.config:
+            return None
+        rows = self.conn.execute('SELECT path, mtime_ns, size, hash, annotation FROM voc_manifest WHERE task=?',
+                                 (self.task,))
+        return {row[0]: row[1:] for row in rows}
+
+    def sync(self, xml_paths, workers=None):
+        '''
+        对比清单, 只解析新增和修改过的xml; 清单要等commit()才更新为xml_paths
+        mtime变了但大小和哈希没变的xml视为未修改
+        :param xml_paths: 本次要转换的全部xml
+        :param workers: 解析进程数
+        :return: (annotations, changed, deleted)
+                 annotations {xml路径: VocAnnotation or None}, 包含xml_paths中的全部xml;
+                 changed 重新解析过的xml路径集合; deleted 上次有本次没有的xml路径列表
+        '''
+        try:
+            rows = self._load_rows()
+        except sqlite3.Error as e:
+            print(f"voc manifest disabled: {e}")
+            rows = {}
+        reset = rows is None
+        rows = rows or {}
+        annotations = {}
+        changed = []
+        touched = []
+        keys = {}
+        for xml_path in xml_paths:
+            key = os.path.abspath(xml_path)
+            keys[key] = xml_path
+            row = rows.get(key)
+            try:
+                st = os.stat(xml_path)
+            except OSError:
+                changed.append(xml_path)
+                continue
+            if row is not None and row[1] == st.st_size:
+                if row[0] == st.st_mtime_ns or row[2] == full_hash(xml_path):
+                    annotations[xml_path] = _load_annotation(row[3], xml_path)
+                    if row[0] != st.st_mtime_ns:
+                        touched.append((st.st_mtime_ns, self.task, key))
+                    continue
+            changed.append(xml_path)
+
+        with ThreadPoolExecutor() as executor:
+            hashes = list(executor.map(lambda path: full_hash(path) if os.path.exists(path) else None, changed))
+        parsed = parse_voc_xmls(changed, workers=workers, desc='parse changed xml') if changed else []
+        updates = []
+        for xml_path, digest, annotation in zip(changed, hashes, parsed):
+            annotations[xml_path] = annotation
+            if annotation is not None:
+                st = os.stat(xml_path)
+                updates.append((self.task, os.path.abspath(xml_path), st.st_mtime_ns, st.st_size, digest,
+                                _dump_annotation(annotation)))
+        deleted = [path for path in rows if path not in keys]
+        # 解析失败的xml不留在清单里, 下次重新解析
+        failed = [(self.task, os.path.abspath(path)) for path, ann in zip(changed, parsed) if ann is None]
+        self._pending = (reset, updates, touched, [(self.task, path) for path in deleted] + failed)
+        print(f"manifest: {len(xml_paths)} xml, {len(changed)} changed, {len(deleted)} deleted")
+        return annotations, set(changed), deleted
+
+    def commit(self):
+        '''
+        把上一次sync的结果写入清单, 在转换结果全部写出之后调用
+        '''
+        if self._pending is None:
+            return
+        reset, updates, touched, removed = self._pending
+        try:
+            with self.conn:
+                if reset:
+                    self.conn.execute('DELETE FROM voc_manifest WHERE task=?', (self.task,))
+                    self.conn.execute('INSERT OR REPLACE INTO voc_task VALUES (?, ?)', (self.task, self.config))
+                self.conn.executemany('INSERT OR REPLACE INTO voc_manifest VALUES (?, ?, ?, ?, ?, ?)', updates)
+                self.conn.executemany('UPDATE voc_manifest SET mtime_ns=? WHERE task=? AND path=?', touched)
+                self.conn.executemany('DELETE FROM voc_manifest WHERE task=? AND path=?', removed)
+        except sqlite3.Error as e:
+            print(f"voc manifest write error: {e}")
+        self._pending = None
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,150 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 10:12
+# @Author : Jovan
+# @File : voc_parser.py
+# @desc : VOC xml 公共解析层, 多进程分片解析 Annotations 目录, 返回紧凑的中间表示
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from lxml import etree
+from tqdm import tqdm
+
+from xml_encoding import flush_encoding_cache, read_xml_bytes
+
+
+class VocObject(NamedTuple):
+    name: Optional[str]
+    difficult: int
+    xmin: float
+    ymin: float
+    xmax: float
+    ymax: float
+
+
+class VocAnnotation(NamedTuple):
+    xml_path: str
+    filename: Optional[str]
+    path: Optional[str]
+    width: Optional[float]
+    height: Optional[float]
+    depth: Optional[float]
+    objects: Tuple[VocObject, ...]
+
+
+def _to_float(text):
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _to_int(text, default=0):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_voc_xml(xml_path: str) -> VocAnnotation:
+    '''
+    解析单个VOC xml, 解析失败直接抛出异常
+    :param xml_path: xml路径
+    :return: VocAnnotation
+    '''
+    data, encoding = read_xml_bytes(xml_path)
+    root = etree.fromstring(data, parser=etree.XMLParser(encoding=encoding))
+
+    size = root.find('size')
+    if size is not None:
+        width = _to_float(size.findtext('width'))
+        height = _to_float(size.findtext('height'))
+        depth = _to_float(size.findtext('depth'))
+    else:
+        width = height = depth = None
+
+    objects = []
+    for obj in root.iter('object'):
+        bndbox = obj.find('bndbox')
+        objects.append(VocObject(
+            name=obj.findtext('name'),
+            difficult=_to_int(obj.findtext('difficult')),
+            xmin=float(bndbox.findtext('xmin')),
+            ymin=float(bndbox.findtext('ymin')),
+            xmax=float(bndbox.findtext('xmax')),
+            ymax=float(bndbox.findtext('ymax')),
+        ))
+
+    return VocAnnotation(
+        xml_path=xml_path,
+        filename=root.findtext('filename'),
+        path=root.findtext('path'),
+        width=width,
+        height=height,
+        depth=depth,
+        objects=tuple(objects),
+    )
+
+
+def _parse_chunk(xml_paths: List[str]) -> List[Optional[VocAnnotation]]:
+    results = []
+    for xml_path in xml_paths:
+        try:
+            results.append(parse_voc_xml(xml_path))
+        except Exception as e:
+            print(f"file:{xml_path},error:{e}")
+            results.append(None)
+    flush_encoding_cache()
+    return results
+
+
+def iter_voc_xmls(xml_paths: Iterable[str],
+                  workers: Optional[int] = None,
+                  chunksize: int = 256,
+                  desc: str = 'parse xml') -> Iterator[Optional[VocAnnotation]]:
+    '''
+    多进程解析一批xml, 按输入顺序逐个产出结果, 解析失败的位置为None
+    :param xml_paths: xml路径列表
+    :param workers: 进程数, None则使用CPU核心数, 1为单进程
+    :param chunksize: 每个任务包含的xml数量
+    :param desc: 进度条描述
+    :return: VocAnnotation or None
+    '''
+    xml_paths = list(xml_paths)
+    workers = workers or os.cpu_count() or 1
+    chunks = [xml_paths[i:i + chunksize] for i in range(0, len(xml_paths), chunksize)]
+    with tqdm(total=len(xml_paths), desc=desc) as pbar:
+        if workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                part = _parse_chunk(chunk)
+                pbar.update(len(part))
+                yield from part
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for part in executor.map(_parse_chunk, chunks):
+                    pbar.update(len(part))
+                    yield from part
+
+
+def parse_voc_xmls(xml_paths: Iterable[str], **kwargs) -> List[Optional[VocAnnotation]]:
+    '''
+    同iter_voc_xmls, 一次返回全部结果
+    '''
+    return list(iter_voc_xmls(xml_paths, **kwargs))
+
+
+def list_xml_files(ann_dir: str) -> List[str]:
+    with os.scandir(ann_dir) as it:
+        xml_paths = [entry.path for entry in it if entry.is_file() and entry.name.endswith('.xml')]
+    xml_paths.sort()
+    return xml_paths
+
+
+def parse_voc_dir(ann_dir: str, **kwargs) -> List[VocAnnotation]:
+    '''
+    解析整个Annotations目录, 只返回解析成功的结果
+    '''
+    return [ann for ann in parse_voc_xmls(list_xml_files(ann_dir), **kwargs) if ann is not None]
@@ -0,0 +1,57 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 17:45
+# @Author : Jovan
+# @File : voc_writer.py
+# @desc : 不建DOM直接拼字符串生成VOC xml, 输出与minidom.toprettyxml(indent="  ")逐字节一致
+from xml.dom import minidom
+
+# 新版本python的minidom文本节点不再转义双引号, 这里跟随当前解释器的行为
+_ESCAPE_QUOTE = '&quot;' in minidom.Document().createTextNode('"').toxml()
+_HEADER = '<?xml version="1.0" ?>'
+
+
+def escape_text(text):
+    # 绝大多数文本不含特殊字符, 先判断再替换
+    if '&' in text or '<' in text or '>' in text or (_ESCAPE_QUOTE and '"' in text):
+        text = text.replace('&', '&amp;').replace('<', '&lt;')
+        if _ESCAPE_QUOTE:
+            text = text.replace('"', '&quot;')
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def _write(parts, tag, value, indent, addindent, newl):
+    if not value:
+        # None或空列表为空节点, 空字符串minidom仍写成<tag></tag>
+        parts.append(f'{indent}<{tag}></{tag}>{newl}' if value == '' else f'{indent}<{tag}/>{newl}')
+        return
+    if isinstance(value, str):
+        parts.append(f'{indent}<{tag}>{escape_text(value)}</{tag}>{newl}')
+        return
+    parts.append(f'{indent}<{tag}>{newl}')
+    child_indent = indent + addindent
+    for child_tag, child_value in value:
+        if child_value and child_value.__class__ is str:
+            parts.append(f'{child_indent}<{child_tag}>{escape_text(child_value)}</{child_tag}>{newl}')
+        else:
+            _write(parts, child_tag, child_value, child_indent, addindent, newl)
+    parts.append(f'{indent}</{tag}>{newl}')
+
+
+def to_pretty_xml(tag, children, indent='  ', newl='\n'):
+    '''
+    生成带缩进的xml字符串
+    :param tag: 根节点名
+    :param children: [(tag, value), ...], value为str时是文本节点, 为list时是子节点, 为None时是空节点
+    :param indent: 每层缩进
+    :param newl: 换行符
+    :return: 与minidom.toprettyxml(indent=indent, newl=newl)相同的字符串
+    '''
+    parts = [_HEADER, newl]
+    _write(parts, tag, children, '', indent, newl)
+    return ''.join(parts)
+
+
+def bndbox(xmin, ymin, xmax, ymax):
+    return ('bndbox', [('xmin', str(xmin)), ('ymin', str(ymin)), ('xmax', str(xmax)), ('ymax', str(ymax))])
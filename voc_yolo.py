@@ -0,0 +1,149 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 20:05
+# @Author : Jovan
+# @File : voc_yolo.py
+# @desc : VOC xml 转 yolo txt, 多进程分片转换, 各进程的类别计数汇总后返回
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from voc_parser import parse_voc_xml
+from xml_encoding import flush_encoding_cache
+
+
+def convert(size, box):
+    dw = 1. / (size[0])
+    dh = 1. / (size[1])
+    x = (box[0] + box[1]) / 2.0 - 1
+    y = (box[2] + box[3]) / 2.0 - 1
+    w = box[1] - box[0]
+    h = box[3] - box[2]
+    x = 1.0 if x * dw >= 1 else x * dw
+    w = 1.0 if w * dw >= 1 else w * dw
+    y = 1.0 if y * dh >= 1 else y * dh
+    h = 1.0 if h * dh >= 1 else h * dh
+    return (x, y, w, h)
+
+
+def class_map_of(classes):
+    '''
+    类别列表转成{类别名: id}
+    '''
+    if isinstance(classes, dict):
+        return classes
+    return {cls: cls_id for cls_id, cls in enumerate(classes)}
+
+
+def convert_annotation(image_id, annotation, label_path, classes, class_count, write=True):
+    '''
+    生成txt文件
+    :param image_id:文件名称(不带后缀)
+    :param annotation: voc_parser解析出的VocAnnotation, 解析失败时为None
+    :param label_path: 生成txt的路径
+    :param classes: 类别列表或{类别名: id}
+    :param write: False时只统计class_count, 不写txt
+    :return:
+    '''
+    txt_name = image_id + '.txt'
+    lines = []
+    try:
+        if annotation is None:
+            return None
+        class_map = class_map_of(classes)
+        w = int(annotation.width)
+        h = int(annotation.height)
+        for obj in annotation.objects:
+            cls = obj.name
+            cls_id = class_map.get(cls)
+            if cls_id is None or obj.difficult == 1:
+                continue
+            b = (obj.xmin, obj.xmax, obj.ymin, obj.ymax)
+            bb = convert((w, h), b)
+            lines.append(str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n')
+            class_count[cls] = class_count.get(cls, 0) + 1
+    except Exception as e:
+        print(f"file:{annotation.xml_path},name:{annotation.filename}, error:{e}")
+    finally:
+        if write:
+            with open(os.path.join(label_path, txt_name), 'w') as out_file:
+                out_file.writelines(lines)
+    return annotation.filename
+
+
+def _convert_chunk(args):
+    jobs, label_path, class_map = args
+    names = []
+    class_count = {}
+    for image_id, xml_path in jobs:
+        try:
+            annotation = parse_voc_xml(xml_path)
+        except Exception as e:
+            print(f"file:{xml_path},error:{e}")
+            annotation = None
+        names.append(convert_annotation(image_id, annotation, label_path, class_map, class_count))
+    flush_encoding_cache()
+    return names, class_count
+
+
+def _iter_chunks(chunks, workers):
+    if workers <= 1 or len(chunks) <= 1:
+        yield from map(_convert_chunk, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_convert_chunk, chunks)
+
+
+def convert_split(image_ids, ann_path, label_path, classes, workers=None, chunksize=256, desc='convert'):
+    '''
+    多进程把一个划分的xml转成yolo txt
+    :param image_ids: 图片id列表, xml为ann_path下同名文件
+    :param ann_path: Annotations目录
+    :param label_path: 生成txt的目录
+    :param classes: 类别列表或{类别名: id}
+    :param workers: 进程数, None则使用CPU核心数, 1为单进程
+    :return: (names, class_count), names与image_ids一一对应, 为xml中的filename, xml解析失败时为None
+    '''
+    class_map = class_map_of(classes)
+    jobs = [(image_id, os.path.join(ann_path, image_id + '.xml')) for image_id in image_ids]
+    chunks = [(jobs[i:i + chunksize], label_path, class_map) for i in range(0, len(jobs), chunksize)]
+    workers = workers or os.cpu_count() or 1
+    names = []
+    class_count = {}
+    start = time.time()
+    with tqdm(total=len(jobs), desc=desc) as pbar:
+        for part_names, part_count in _iter_chunks(chunks, workers):
+            names.extend(part_names)
+            for cls, count in part_count.items():
+                class_count[cls] = class_count.get(cls, 0) + count
+            pbar.update(len(part_names))
+    cost = max(time.time() - start, 1e-6)
+    print(f"{desc}: {len(names)} images, {sum(class_count.values())} boxes, {cost:.1f}s, "
+          f"{len(names) / cost:.1f} images/s")
+    return names, class_count
+
+
+def convert_split_incremental(image_ids, ann_path, label_path, classes, annotations, changed, desc='convert'):
+    '''
+    增量转换, 只重写xml有变化或txt不存在的图片, 其余图片只统计类别
+    :param annotations: VocManifest.sync返回的{xml路径: VocAnnotation}
+    :param changed: VocManifest.sync返回的有变化的xml路径集合
+    :return: 同convert_split
+    '''
+    class_map = class_map_of(classes)
+    names = []
+    class_count = {}
+    written = 0
+    start = time.time()
+    for image_id in tqdm(image_ids, desc=desc):
+        xml_path = os.path.join(ann_path, image_id + '.xml')
+        write = xml_path in changed or not os.path.exists(os.path.join(label_path, image_id + '.txt'))
+        written += write
+        names.append(convert_annotation(image_id, annotations.get(xml_path), label_path, class_map, class_count,
+                                        write=write))
+    cost = max(time.time() - start, 1e-6)
+    print(f"{desc}: {len(names)} images, {written} written, {sum(class_count.values())} boxes, {cost:.1f}s, "
+          f"{len(names) / cost:.1f} images/s")
+    return names, class_count
@@ -16,16 +16,28 @@
 
 import argparse
 import glob
+import itertools
 import json
+import math
 import os
 import os.path as osp
-import shutil
-import xml.etree.ElementTree as ET
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import PIL.ImageDraw
 from tqdm import tqdm
-import cv2
+
+from coco_writer import CocoJsonWriter
+from image_meta import get_default_store
+from stage_file import STAGE_MODES, stage_file
+from voc_parser import iter_voc_xmls
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 label_to_num = {}
 categories_list = []
@@ -93,19 +105,70 @@ def annotations_rectangle(points, label, image_num, object_num, label_to_num):
 
 
 def annotations_polygon(height, width, points, label, image_num, object_num,
-                        label_to_num):
+                        label_to_num, bbox=None):
     annotation = {}
     annotation['segmentation'] = [list(np.asarray(points).flatten())]
     annotation['iscrowd'] = 0
     annotation['image_id'] = image_num + 1
-    annotation['bbox'] = list(map(float, get_bbox(height, width, points)))
+    if bbox is None:
+        bbox = get_bbox(height, width, points)
+    annotation['bbox'] = list(map(float, bbox))
     annotation['area'] = annotation['bbox'][2] * annotation['bbox'][3]
     annotation['category_id'] = label_to_num[label]
     annotation['id'] = object_num + 1
     return annotation
 
 
-def get_bbox(height, width, points):
+def get_bbox(height, width, points, method='analytic'):
+    '''
+    多边形外接框[x, y, w, h]
+    :param method: analytic 顶点坐标向下取整后取最值并裁剪到图像内, 不画mask;
+                   raster 原来的做法, 把多边形画到整张mask上再找最值, 只用于校验
+    '''
+    if method == 'raster':
+        return get_bbox_raster(height, width, points)
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    left_top_c = min(max(math.floor(min(xs)), 0), width - 1)
+    left_top_r = min(max(math.floor(min(ys)), 0), height - 1)
+    right_bottom_c = min(max(math.floor(max(xs)), 0), width - 1)
+    right_bottom_r = min(max(math.floor(max(ys)), 0), height - 1)
+    return [
+        left_top_c, left_top_r, right_bottom_c - left_top_c,
+        right_bottom_r - left_top_r
+    ]
+
+
+def get_bboxes(height, width, polygons, verify=False):
+    '''
+    一次算出一张图所有多边形的外接框, 结果与逐个调用get_bbox相同
+    多边形越过图像边界时与栅格化结果可能差几个像素, verify=True时逐个和raster结果比对并打印差异
+    :param polygons: [points, ...]
+    :return: [N, 4] int64数组, 每行[x, y, w, h]
+    '''
+    if not polygons:
+        return np.zeros((0, 4), dtype=np.int64)
+    counts = [len(points) for points in polygons]
+    vertices = np.floor(np.asarray([p for points in polygons for p in points], dtype=np.float64)[:, :2])
+    offsets = np.cumsum([0] + counts[:-1])
+    upper = np.array([width - 1, height - 1], dtype=np.float64)
+    mins = np.clip(np.minimum.reduceat(vertices, offsets, axis=0), 0, upper)
+    maxs = np.clip(np.maximum.reduceat(vertices, offsets, axis=0), 0, upper)
+    bboxes = np.hstack([mins, maxs - mins]).astype(np.int64)
+    if verify:
+        for points, bbox in zip(polygons, bboxes):
+            try:
+                raster = get_bbox_raster(height, width, points)
+            except ValueError:
+                raster = None
+            if raster is not None:
+                raster = [int(v) for v in raster]
+            if bbox.tolist() != raster:
+                print(f"bbox mismatch: analytic:{bbox.tolist()}, raster:{raster}, points:{points}")
+    return bboxes
+
+
+def get_bbox_raster(height, width, points):
     polygons = points
     mask = np.zeros([height, width], dtype=np.uint8)
     mask = PIL.Image.fromarray(mask)
@@ -125,69 +188,166 @@ def get_bbox(height, width, points):
     ]
 
 
-def deal_json(ds_type, img_path, json_path):
+IMG_EXTS = ['bmp', 'jpg', 'jpeg', 'png', 'JPEG', 'JPG', 'PNG']
+
+
+def list_label_images(img_path):
+    '''
+    目录下的图片文件名, 排序后保证每次生成的id一致
+    '''
+    return sorted(img_file for img_file in os.listdir(img_path)
+                  if img_file.split('.')[-1] in IMG_EXTS)
+
+
+def load_json(label_file):
+    if orjson is not None:
+        with open(label_file, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(label_file) as f:
+        return json.load(f)
+
+
+def parse_label_json(ds_type, img_file, label_file, verify_bbox=False):
+    '''
+    解析单个labelme/cityscape json, 生成不带id的image和annotations, id由build_coco统一分配
+    :return: (image, [(label, annotation), ...]), 不支持的shape_type对应的annotation为None
+    '''
+    data = load_json(label_file)
+    shapes_list = []
+    if ds_type == 'labelme':
+        image = images_labelme(data, -1)
+        bboxes = iter(get_bboxes(data['imageHeight'], data['imageWidth'],
+                                 [shapes['points'] for shapes in data['shapes']
+                                  if shapes['shape_type'] == 'polygon'],
+                                 verify=verify_bbox))
+        for shapes in data['shapes']:
+            label = shapes['label']
+            annotation = None
+            p_type = shapes['shape_type']
+            if p_type == 'polygon':
+                annotation = annotations_polygon(
+                    data['imageHeight'], data['imageWidth'], shapes['points'],
+                    label, -1, -1, {label: None}, bbox=next(bboxes))
+            if p_type == 'rectangle':
+                (x1, y1), (x2, y2) = shapes['points']
+                x1, x2 = sorted([x1, x2])
+                y1, y2 = sorted([y1, y2])
+                points = [[x1, y1], [x2, y2], [x1, y2], [x2, y1]]
+                annotation = annotations_rectangle(points, label, -1, -1,
+                                                   {label: None})
+            shapes_list.append((label, annotation))
+    else:
+        image = images_cityscape(data, -1, img_file)
+        bboxes = get_bboxes(data['imgHeight'], data['imgWidth'],
+                            [shapes['polygon'] for shapes in data['objects']],
+                            verify=verify_bbox)
+        for shapes, bbox in zip(data['objects'], bboxes):
+            label = shapes['label']
+            annotation = annotations_polygon(
+                data['imgHeight'], data['imgWidth'], shapes['polygon'], label,
+                -1, -1, {label: None}, bbox=bbox)
+            shapes_list.append((label, annotation))
+    return image, shapes_list
+
+
+def _parse_label_chunk(jobs):
+    results = []
+    for ds_type, img_file, label_file, verify_bbox in jobs:
+        try:
+            results.append(parse_label_json(ds_type, img_file, label_file, verify_bbox))
+        except Exception as e:
+            print(f"file:{label_file},error:{e}")
+            results.append(None)
+    return results
+
+
+def iter_label_jsons(ds_type, img_files, json_path, workers=None, chunksize=64,
+                     verify_bbox=False):
+    '''
+    多进程解析图片对应的json, 按输入顺序逐个产出parse_label_json的结果, 解析失败的位置为None
+    :param img_files: 图片文件名列表, json为json_path下同名文件
+    :param workers: 进程数, None则使用CPU核心数, 1为单进程
+    '''
+    jobs = [(ds_type, img_file,
+             osp.join(json_path, os.path.splitext(img_file)[0] + '.json'),
+             verify_bbox) for img_file in img_files]
+    workers = workers or os.cpu_count() or 1
+    chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+    with tqdm(total=len(jobs), desc='parse json') as pbar:
+        if workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                part = _parse_label_chunk(chunk)
+                pbar.update(len(part))
+                yield from part
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for part in executor.map(_parse_label_chunk, chunks):
+                    pbar.update(len(part))
+                    yield from part
+
+
+def build_coco(records, writer=None):
+    '''
+    按顺序给parse_label_json的结果分配image/annotation/category id
+    writer不为None时, images和annotations直接写入CocoJsonWriter, 不再返回整个字典
+    '''
     data_coco = {}
     images_list = []
     annotations_list = []
+    add_image = writer.add_image if writer is not None else images_list.append
+    add_annotation = writer.add_annotation if writer is not None else annotations_list.append
     image_num = -1
     object_num = -1
-    for img_file in os.listdir(img_path):
-        img_label = os.path.splitext(img_file)[0]
-        if img_file.split('.')[
-                -1] not in ['bmp', 'jpg', 'jpeg', 'png', 'JPEG', 'JPG', 'PNG']:
+    for record in records:
+        if record is None:
             continue
-        label_file = osp.join(json_path, img_label + '.json')
-        print('Generating dataset from:', label_file)
+        image, shapes_list = record
         image_num = image_num + 1
-        with open(label_file) as f:
-            data = json.load(f)
-            if ds_type == 'labelme':
-                images_list.append(images_labelme(data, image_num))
-            elif ds_type == 'cityscape':
-                images_list.append(images_cityscape(data, image_num, img_file))
-            if ds_type == 'labelme':
-                for shapes in data['shapes']:
-                    object_num = object_num + 1
-                    label = shapes['label']
-                    if label not in labels_list:
-                        categories_list.append(categories(label, labels_list))
-                        labels_list.append(label)
-                        label_to_num[label] = len(labels_list)
-                    p_type = shapes['shape_type']
-                    if p_type == 'polygon':
-                        points = shapes['points']
-                        annotations_list.append(
-                            annotations_polygon(data['imageHeight'], data[
-                                'imageWidth'], points, label, image_num,
-                                                object_num, label_to_num))
-
-                    if p_type == 'rectangle':
-                        (x1, y1), (x2, y2) = shapes['points']
-                        x1, x2 = sorted([x1, x2])
-                        y1, y2 = sorted([y1, y2])
-                        points = [[x1, y1], [x2, y2], [x1, y2], [x2, y1]]
-                        annotations_list.append(
-                            annotations_rectangle(points, label, image_num,
-                                                  object_num, label_to_num))
-            elif ds_type == 'cityscape':
-                for shapes in data['objects']:
-                    object_num = object_num + 1
-                    label = shapes['label']
-                    if label not in labels_list:
-                        categories_list.append(categories(label, labels_list))
-                        labels_list.append(label)
-                        label_to_num[label] = len(labels_list)
-                    points = shapes['polygon']
-                    annotations_list.append(
-                        annotations_polygon(data['imgHeight'], data[
-                            'imgWidth'], points, label, image_num, object_num,
-                                            label_to_num))
+        image['id'] = image_num + 1
+        add_image(image)
+        for label, annotation in shapes_list:
+            object_num = object_num + 1
+            if label not in labels_list:
+                categories_list.append(categories(label, labels_list))
+                labels_list.append(label)
+                label_to_num[label] = len(labels_list)
+            if annotation is not None:
+                annotation['image_id'] = image_num + 1
+                annotation['category_id'] = label_to_num[label]
+                annotation['id'] = object_num + 1
+                add_annotation(annotation)
+    if writer is not None:
+        for category in categories_list:
+            writer.add_category(category)
+        return None
     data_coco['images'] = images_list
     data_coco['categories'] = categories_list
     data_coco['annotations'] = annotations_list
     return data_coco
 
 
+def set_file_names(records, file_names):
+    '''
+    把iter_label_jsons结果中image的file_name依次替换为file_names
+    '''
+    for record, file_name in zip(records, file_names):
+        if record is not None:
+            record[0]['file_name'] = file_name
+        yield record
+
+
+def deal_json(ds_type, img_path, json_path, writer=None, verify_bbox=False,
+              workers=None):
+    '''
+    转换img_path下全部图片对应的json
+    writer不为None时, images和annotations直接写入CocoJsonWriter, 不再返回整个字典
+    verify_bbox为True时用栅格化的方法校验多边形外接框
+    '''
+    records = iter_label_jsons(ds_type, list_label_images(img_path), json_path,
+                               workers=workers, verify_bbox=verify_bbox)
+    return build_coco(records, writer=writer)
+
+
 def voc_get_label_anno(ann_dir_path, ann_ids_path, labels_path):
     with open(labels_path, 'r') as f:
         labels_str = f.read().split()
@@ -207,14 +367,13 @@ def voc_get_label_anno(ann_dir_path, ann_ids_path, labels_path):
     return dict(zip(labels_str, labels_ids)), ann_paths
 
 
-def voc_get_image_info(annotation_root, im_id):
-    filename = annotation_root.findtext('filename')
+def voc_get_image_info(annotation, im_id):
+    filename = annotation.filename
     assert filename is not None
     img_name = os.path.basename(filename)
 
-    size = annotation_root.find('size')
-    width = float(size.findtext('width'))
-    height = float(size.findtext('height'))
+    width = annotation.width
+    height = annotation.height
 
     image_info = {
         'file_name': filename,
@@ -226,14 +385,13 @@ def voc_get_image_info(annotation_root, im_id):
 
 
 def voc_get_coco_annotation(obj, label2id):
-    label = obj.findtext('name')
+    label = obj.name
     assert label in label2id, "label is not in label2id."
     category_id = label2id[label]
-    bndbox = obj.find('bndbox')
-    xmin = float(bndbox.findtext('xmin'))
-    ymin = float(bndbox.findtext('ymin'))
-    xmax = float(bndbox.findtext('xmax'))
-    ymax = float(bndbox.findtext('ymax'))
+    xmin = obj.xmin
+    ymin = obj.ymin
+    xmax = obj.xmax
+    ymax = obj.ymax
     assert xmax > xmin and ymax > ymin, "Box size error."
     o_width = xmax - xmin
     o_height = ymax - ymin
@@ -247,41 +405,33 @@ def voc_get_coco_annotation(obj, label2id):
     return anno
 
 
-def voc_xmls_to_cocojson(annotation_paths, label2id, output_dir, output_file):
-    output_json_dict = {
-        "images": [],
-        "type": "instances",
-        "annotations": [],
-        "categories": []
-    }
+def voc_xmls_to_cocojson(annotation_paths, label2id, output_dir, output_file,
+                         workers=None):
     bnd_id = 1  # bounding box start id
     im_id = 0
     print('Start converting !')
-    for a_path in tqdm(annotation_paths):
-        # Read annotation xml
-        ann_tree = ET.parse(a_path)
-        ann_root = ann_tree.getroot()
-
-        img_info = voc_get_image_info(ann_root, im_id)
-        output_json_dict['images'].append(img_info)
-
-        for obj in ann_root.findall('object'):
-            ann = voc_get_coco_annotation(obj=obj, label2id=label2id)
-            ann.update({'image_id': im_id, 'id': bnd_id})
-            output_json_dict['annotations'].append(ann)
-            bnd_id = bnd_id + 1
-        im_id += 1
-
-    for label, label_id in label2id.items():
-        category_info = {'supercategory': 'none', 'id': label_id, 'name': label}
-        output_json_dict['categories'].append(category_info)
     output_file = os.path.join(output_dir, output_file)
-    with open(output_file, 'w') as f:
-        output_json = json.dumps(output_json_dict)
-        f.write(output_json)
+    with CocoJsonWriter(output_file) as writer:
+        for annotation in iter_voc_xmls(annotation_paths, workers=workers):
+            if annotation is None:
+                continue
+
+            img_info = voc_get_image_info(annotation, im_id)
+            writer.add_image(img_info)
 
+            for obj in annotation.objects:
+                ann = voc_get_coco_annotation(obj=obj, label2id=label2id)
+                ann.update({'image_id': im_id, 'id': bnd_id})
+                writer.add_annotation(ann)
+                bnd_id = bnd_id + 1
+            im_id += 1
 
-def widerface_to_cocojson(root_path):
+        for label, label_id in label2id.items():
+            category_info = {'supercategory': 'none', 'id': label_id, 'name': label}
+            writer.add_category(category_info)
+
+
+def widerface_to_cocojson(root_path, workers=None):
     train_gt_txt = os.path.join(root_path, "wider_face_split", "wider_face_train_bbx_gt.txt")
     val_gt_txt = os.path.join(root_path, "wider_face_split", "wider_face_val_bbx_gt.txt")
     train_img_dir = os.path.join(root_path, "WIDER_train", "images")
@@ -290,60 +440,86 @@ def widerface_to_cocojson(root_path):
     assert val_gt_txt
     assert train_img_dir
     assert val_img_dir
-    save_path = os.path.join(root_path, "widerface_train.json")
-    widerface_convert(train_gt_txt, train_img_dir, save_path)
-    print("Wider Face train dataset converts sucess, the json path: {}".format(save_path))
-    save_path = os.path.join(root_path, "widerface_val.json")
-    widerface_convert(val_gt_txt, val_img_dir, save_path)
-    print("Wider Face val dataset converts sucess, the json path: {}".format(save_path))
-
-
-def widerface_convert(gt_txt, img_dir, save_path):
-    output_json_dict = {
-        "images": [],
-        "type": "instances",
-        "annotations": [],
-        "categories": [{'supercategory': 'none', 'id': 0, 'name': "human_face"}]
-    }
+    train_save_path = os.path.join(root_path, "widerface_train.json")
+    val_save_path = os.path.join(root_path, "widerface_val.json")
+    # train/val两个划分各用一个进程同时转换
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        train_future = executor.submit(widerface_convert, train_gt_txt, train_img_dir, train_save_path, workers)
+        val_future = executor.submit(widerface_convert, val_gt_txt, val_img_dir, val_save_path, workers)
+        train_future.result()
+        print("Wider Face train dataset converts sucess, the json path: {}".format(train_save_path))
+        val_future.result()
+        print("Wider Face val dataset converts sucess, the json path: {}".format(val_save_path))
+
+
+def iter_widerface_gt(gt_txt):
+    '''
+    逐张图片读取WIDER FACE标注文件, 不一次读入整个文件
+    :return: (image_name, [bbox行, ...]), 没有框的图片bbox行为空列表
+    '''
+    with open(gt_txt) as fd:
+        for line in fd:
+            image_name = line.strip()
+            if not image_name:
+                continue
+            bbox_num = int(next(fd).strip())
+            # 没有框的图片后面仍有一行全0占位
+            bbox_lines = [next(fd) for _ in range(max(bbox_num, 1))]
+            yield image_name, bbox_lines[:bbox_num]
+
+
+def iter_widerface_image_info(gt_records, img_dir, workers=None, prefetch=256):
+    '''
+    线程池预取图片尺寸, 按标注文件顺序产出(image_name, img_info, bbox行), 最多同时预取prefetch张
+    '''
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for im_id, (image_name, bbox_lines) in enumerate(gt_records):
+            pending.append((image_name, bbox_lines,
+                            executor.submit(get_widerface_image_info, img_dir, image_name, im_id)))
+            if len(pending) >= prefetch:
+                image_name, bbox_lines, future = pending.popleft()
+                yield image_name, future.result(), bbox_lines
+        while pending:
+            image_name, bbox_lines, future = pending.popleft()
+            yield image_name, future.result(), bbox_lines
+
+
+def widerface_convert(gt_txt, img_dir, save_path, workers=None):
+    categories = [{'supercategory': 'none', 'id': 0, 'name': "human_face"}]
     bnd_id = 1  # bounding box start id
-    im_id = 0
     print('Start converting !')
-    with open(gt_txt) as fd:
-        lines = fd.readlines()
-
-    i = 0
-    while i < len(lines):
-        image_name = lines[i].strip()
-        bbox_num = int(lines[i + 1].strip())
-        i += 2
-        img_info = get_widerface_image_info(img_dir, image_name, im_id)
-        if img_info:
-            output_json_dict["images"].append(img_info)
-            for j in range(i, i + bbox_num):
-                anno = get_widerface_ann_info(lines[j])
-                anno.update({'image_id': im_id, 'id': bnd_id})
-                output_json_dict['annotations'].append(anno)
-                bnd_id += 1
-        else:
-            print("The image dose not exist: {}".format(os.path.join(img_dir, image_name)))
-        bbox_num = 1 if bbox_num == 0 else bbox_num
-        i += bbox_num
-        im_id += 1
-    with open(save_path, 'w') as f:
-        output_json = json.dumps(output_json_dict)
-        f.write(output_json)
+    start = time.time()
+    with CocoJsonWriter(save_path, categories=categories) as writer:
+        records = iter_widerface_image_info(iter_widerface_gt(gt_txt), img_dir, workers=workers)
+        for image_name, img_info, bbox_lines in tqdm(records, desc=os.path.basename(gt_txt), unit='img'):
+            if img_info:
+                writer.add_image(img_info)
+                for line in bbox_lines:
+                    anno = get_widerface_ann_info(line)
+                    anno.update({'image_id': img_info['id'], 'id': bnd_id})
+                    writer.add_annotation(anno)
+                    bnd_id += 1
+            else:
+                print("The image dose not exist: {}".format(os.path.join(img_dir, image_name)))
+    get_default_store().flush()
+    cost = max(time.time() - start, 1e-6)
+    print("{}: {} images, {} boxes, {:.1f}s, {:.1f} images/s".format(
+        os.path.basename(gt_txt), writer.image_count, writer.annotation_count, cost,
+        writer.image_count / cost))
 
 
 def get_widerface_image_info(img_root, img_relative_path, img_id):
     image_info = {}
     save_path = os.path.join(img_root, img_relative_path)
-    if os.path.exists(save_path):
-        img = cv2.imread(save_path)
+    size = get_default_store().image_size(save_path) if os.path.exists(save_path) else None
+    if size is not None:
         image_info["file_name"] = os.path.join(os.path.basename(
             os.path.dirname(img_root)), os.path.basename(img_root),
             img_relative_path)
-        image_info["height"] = img.shape[0]
-        image_info["width"] = img.shape[1]
+        image_info["height"] = size.height
+        image_info["width"] = size.width
         image_info["id"] = img_id
     return image_info
 
@@ -411,6 +587,22 @@ def main():
         type=str,
         default='voc.json',
         help='In Voc format dataset, path to output json file')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='number of processes used to parse xml/json files (threads probing image sizes for widerface), default is cpu count')
+    parser.add_argument(
+        '--split_mode',
+        choices=STAGE_MODES + ['manifest'],
+        default='copy',
+        help='In labelme/cityscape dataset, how images are put into train/val/test: copy, hardlink, symlink, '
+             'reflink, or manifest which writes the original image paths into file_name and {split}.txt '
+             'without touching images')
+    parser.add_argument(
+        '--verify_bbox',
+        action='store_true',
+        help='In labelme/cityscape dataset, also rasterize every polygon and report bbox mismatches')
     parser.add_argument(
         '--widerface_root_dir',
         help='The root_path for wider face dataset, which contains `wider_face_split`, `WIDER_train` and `WIDER_val`.And the json file will save in this path',
@@ -432,10 +624,11 @@ def main():
             annotation_paths=ann_paths,
             label2id=label2id,
             output_dir=args.output_dir,
-            output_file=args.voc_out_name)
+            output_file=args.voc_out_name,
+            workers=args.workers)
     elif args.dataset_type == "widerface":
         assert args.widerface_root_dir
-        widerface_to_cocojson(args.widerface_root_dir)
+        widerface_to_cocojson(args.widerface_root_dir, workers=args.workers)
     else:
         try:
             assert os.path.exists(args.json_input_dir)
@@ -457,11 +650,12 @@ def main():
             os._exit(0)
 
         # Allocate the dataset.
+        manifest = args.split_mode == 'manifest'
         total_num = len(glob.glob(osp.join(args.json_input_dir, '*.json')))
         if args.train_proportion != 0:
             train_num = int(total_num * args.train_proportion)
             out_dir = args.output_dir + '/train'
-            if not os.path.exists(out_dir):
+            if not manifest and not os.path.exists(out_dir):
                 os.makedirs(out_dir)
         else:
             train_num = 0
@@ -469,73 +663,65 @@ def main():
             val_num = 0
             test_num = total_num - train_num
             out_dir = args.output_dir + '/test'
-            if args.test_proportion != 0.0 and not os.path.exists(out_dir):
+            if args.test_proportion != 0.0 and not manifest and not os.path.exists(out_dir):
                 os.makedirs(out_dir)
         else:
             val_num = int(total_num * args.val_proportion)
             test_num = total_num - train_num - val_num
             val_out_dir = args.output_dir + '/val'
-            if not os.path.exists(val_out_dir):
+            if not manifest and not os.path.exists(val_out_dir):
                 os.makedirs(val_out_dir)
             test_out_dir = args.output_dir + '/test'
-            if args.test_proportion != 0.0 and not os.path.exists(test_out_dir):
+            if args.test_proportion != 0.0 and not manifest and not os.path.exists(test_out_dir):
                 os.makedirs(test_out_dir)
+        split_images = {'train': [], 'val': [], 'test': []}
         count = 1
-        for img_name in os.listdir(args.image_input_dir):
+        for img_name in sorted(os.listdir(args.image_input_dir)):
             if count <= train_num:
-                if osp.exists(args.output_dir + '/train/'):
-                    shutil.copyfile(
-                        osp.join(args.image_input_dir, img_name),
-                        osp.join(args.output_dir + '/train/', img_name))
+                split = 'train'
+            elif count <= train_num + val_num:
+                split = 'val'
             else:
-                if count <= train_num + val_num:
-                    if osp.exists(args.output_dir + '/val/'):
-                        shutil.copyfile(
-                            osp.join(args.image_input_dir, img_name),
-                            osp.join(args.output_dir + '/val/', img_name))
-                else:
-                    if osp.exists(args.output_dir + '/test/'):
-                        shutil.copyfile(
-                            osp.join(args.image_input_dir, img_name),
-                            osp.join(args.output_dir + '/test/', img_name))
+                split = 'test'
+            split_dir = args.output_dir + '/' + split + '/'
+            # manifest模式不动图片, 只记录划分结果
+            if manifest:
+                split_images[split].append(img_name)
+            elif osp.exists(split_dir):
+                stage_file(
+                    osp.join(args.image_input_dir, img_name),
+                    osp.join(split_dir, img_name), args.split_mode)
+                split_images[split].append(img_name)
             count = count + 1
 
         # Deal with the json files.
         if not os.path.exists(args.output_dir + '/annotations'):
             os.makedirs(args.output_dir + '/annotations')
-        if args.train_proportion != 0:
-            train_data_coco = deal_json(args.dataset_type,
-                                        args.output_dir + '/train',
-                                        args.json_input_dir)
-            train_json_path = osp.join(args.output_dir + '/annotations',
-                                       'instance_train.json')
-            json.dump(
-                train_data_coco,
-                open(train_json_path, 'w'),
-                indent=4,
-                cls=MyEncoder)
-        if args.val_proportion != 0:
-            val_data_coco = deal_json(args.dataset_type,
-                                      args.output_dir + '/val',
-                                      args.json_input_dir)
-            val_json_path = osp.join(args.output_dir + '/annotations',
-                                     'instance_val.json')
-            json.dump(
-                val_data_coco,
-                open(val_json_path, 'w'),
-                indent=4,
-                cls=MyEncoder)
-        if args.test_proportion != 0:
-            test_data_coco = deal_json(args.dataset_type,
-                                       args.output_dir + '/test',
-                                       args.json_input_dir)
-            test_json_path = osp.join(args.output_dir + '/annotations',
-                                      'instance_test.json')
-            json.dump(
-                test_data_coco,
-                open(test_json_path, 'w'),
-                indent=4,
-                cls=MyEncoder)
+        # 三个划分的json一次性并行解析, 再按顺序分给各自的writer
+        splits = [(split, [img_file for img_file in split_images[split]
+                           if img_file.split('.')[-1] in IMG_EXTS])
+                  for split, proportion in [('train', args.train_proportion),
+                                            ('val', args.val_proportion),
+                                            ('test', args.test_proportion)]
+                  if proportion != 0]
+        records = iter_label_jsons(args.dataset_type,
+                                   [img_file for _, img_files in splits for img_file in img_files],
+                                   args.json_input_dir,
+                                   workers=args.workers,
+                                   verify_bbox=args.verify_bbox)
+        for split, img_files in splits:
+            split_records = itertools.islice(records, len(img_files))
+            if manifest:
+                # file_name直接写原图路径, 同时输出每个划分的图片列表
+                image_paths = [osp.abspath(osp.join(args.image_input_dir, img_file))
+                               for img_file in img_files]
+                with open(osp.join(args.output_dir, split + '.txt'), 'w') as f:
+                    f.writelines(image_path + '\n' for image_path in image_paths)
+                split_records = set_file_names(split_records, image_paths)
+            json_path = osp.join(args.output_dir + '/annotations',
+                                 'instance_{}.json'.format(split))
+            with CocoJsonWriter(json_path, type_name=None, cls=MyEncoder) as writer:
+                build_coco(split_records, writer=writer)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,144 @@
+#! python3
+# _*_ coding: utf-8 _*_
+# @Time : 2026/10/18 11:10
+# @Author : Jovan
+# @File : xml_encoding.py
+# @desc : xml编码识别, 优先信任BOM/xml声明并尝试utf-8, 失败才用chardet, 结果按(路径, mtime, 大小)缓存
+import os
+import re
+import sqlite3
+from typing import Optional, Tuple
+
+import chardet
+
+import cache_db
+
+# chardet只看文件开头这么多字节
+SNIFF_BYTES = 64 * 1024
+# 缓存攒够这么多条再写库
+FLUSH_SIZE = 512
+
+_BOMS = (
+    (b'\xef\xbb\xbf', 'utf-8'),
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+)
+_PROLOG_RE = re.compile(rb'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([A-Za-z0-9._:-]+)["\']')
+
+_memo = {}
+_pending = []
+_conn = None
+_conn_pid = None
+
+
+def _get_conn():
+    # 每个进程单独一个连接, fork出来的子进程不能复用父进程的连接
+    global _conn, _conn_pid
+    if _conn_pid != os.getpid():
+        _conn_pid = os.getpid()
+        try:
+            _conn = cache_db.connect(cache_db.cache_path('xml_encoding.sqlite'))
+            _conn.execute('CREATE TABLE IF NOT EXISTS encoding_cache ('
+                          'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, encoding TEXT)')
+        except (OSError, sqlite3.Error) as e:
+            print(f"encoding cache disabled: {e}")
+            _conn = None
+    return _conn
+
+
+def _cache_get(key):
+    if key in _memo:
+        return _memo[key]
+    conn = _get_conn()
+    if conn is None:
+        return None
+    path, mtime_ns, size = key
+    try:
+        row = conn.execute('SELECT mtime_ns, size, encoding FROM encoding_cache WHERE path=?', (path,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is not None and row[0] == mtime_ns and row[1] == size:
+        _memo[key] = row[2]
+        return row[2]
+    return None
+
+
+def _cache_put(key, encoding):
+    _memo[key] = encoding
+    _pending.append((key[0], key[1], key[2], encoding))
+    if len(_pending) >= FLUSH_SIZE:
+        flush_encoding_cache()
+
+
+def flush_encoding_cache():
+    '''
+    把新识别的编码写入缓存库, 多进程解析时每个任务结束调用一次
+    '''
+    conn = _get_conn()
+    if conn is None or not _pending:
+        _pending.clear()
+        return
+    try:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO encoding_cache VALUES (?, ?, ?, ?)', _pending)
+    except sqlite3.Error as e:
+        print(f"encoding cache write error: {e}")
+    _pending.clear()
+
+
+def sniff_encoding(data: bytes) -> Optional[str]:
+    '''
+    只根据BOM和xml声明判断编码, 判断不出返回None
+    '''
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    match = _PROLOG_RE.match(data[:1024])
+    if match:
+        return match.group(1).decode('ascii')
+    return None
+
+
+def guess_encoding(data: bytes) -> str:
+    '''
+    识别xml字节流的编码
+    1. 有BOM直接用BOM
+    2. 用xml声明的编码(没有声明则utf-8)能完整解码就用它
+    3. 否则只对开头SNIFF_BYTES字节用chardet, 置信度低时优先尝试gb18030
+    '''
+    encoding = sniff_encoding(data)
+    try:
+        data.decode(encoding or 'utf-8')
+        return encoding or 'utf-8'
+    except (UnicodeDecodeError, LookupError):
+        pass
+
+    result = chardet.detect(data[:SNIFF_BYTES])
+    if result['encoding'] is None or result['confidence'] < 0.5:
+        try:
+            data.decode('gb18030')
+            return 'gb18030'
+        except UnicodeDecodeError:
+            pass
+    return result['encoding'] or 'utf-8'
+
+
+def _cache_key(file_path):
+    st = os.stat(file_path)
+    return os.path.abspath(file_path), st.st_mtime_ns, st.st_size
+
+
+def read_xml_bytes(file_path: str) -> Tuple[bytes, str]:
+    '''
+    读取xml内容并返回(字节流, 编码), 同一文件未修改时编码直接取缓存
+    '''
+    key = _cache_key(file_path)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    encoding = _cache_get(key)
+    if encoding is None:
+        encoding = guess_encoding(data)
+        _cache_put(key, encoding)
+    return data, encoding
@@ -6,13 +6,13 @@
 # @desc :
 
 import os
-import cv2
 import logging
-from xml.etree import ElementTree as ET
-from xml.dom import minidom
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple, List, Optional
 
+from image_meta import get_default_store
+from voc_writer import bndbox, to_pretty_xml
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,20 +21,10 @@ logger = logging.getLogger(__name__)
 def get_image_dimensions(image_path: str) -> Optional[Tuple[int, int, int]]:
     """快速获取图片尺寸信息，不加载完整图片"""
     try:
-        # 方法1: 使用OpenCV仅读取元数据
-        img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED | cv2.IMREAD_IGNORE_ORIENTATION)
-        if img is not None:
-            h, w = img.shape[:2]
-            channels = img.shape[2] if len(img.shape) > 2 else 1
-            return w, h, channels
-
-        # 方法2: 回退到PIL（需要安装Pillow）
-        try:
-            from PIL import Image
-            with Image.open(image_path) as img:
-                return img.width, img.height, len(img.getbands())
-        except ImportError:
-            pass
+        # 先查元数据缓存, 未命中时只读文件头, 解析不了再回退到OpenCV/PIL解码
+        size = get_default_store().image_size(image_path)
+        if size is not None:
+            return size.width, size.height, size.channels
 
         logger.warning(f"无法获取图片尺寸: {image_path}")
         return None
@@ -84,15 +74,11 @@ def process_single_file(txt_path: str, img_dir: str, xml_dir: str,
     img_w, img_h, depth = dimensions
 
     # 创建XML结构
-    annotation = ET.Element('annotation')
-
-    ET.SubElement(annotation, 'folder').text = 'VOC_dataset'
-    ET.SubElement(annotation, 'filename').text = os.path.basename(img_path)
-
-    size = ET.SubElement(annotation, 'size')
-    ET.SubElement(size, 'width').text = str(img_w)
-    ET.SubElement(size, 'height').text = str(img_h)
-    ET.SubElement(size, 'depth').text = str(depth)
+    annotation = [
+        ('folder', 'VOC_dataset'),
+        ('filename', os.path.basename(img_path)),
+        ('size', [('width', str(img_w)), ('height', str(img_h)), ('depth', str(depth))]),
+    ]
 
     # 解析YOLO标注
     try:
@@ -113,24 +99,20 @@ def process_single_file(txt_path: str, img_dir: str, xml_dir: str,
             x_center, y_center, w, h = map(float, data[1:])
             xmin, ymin, xmax, ymax = yolo_to_voc(x_center, y_center, w, h, img_w, img_h)
 
-            # 添加对象节点
-            obj = ET.SubElement(annotation, 'object')
-            ET.SubElement(obj, 'name').text = class_dict.get(class_id, 'unknown')
-            ET.SubElement(obj, 'pose').text = 'Unspecified'
-            ET.SubElement(obj, 'truncated').text = '0'
-            ET.SubElement(obj, 'difficult').text = '0'
-
-            bndbox = ET.SubElement(obj, 'bndbox')
-            ET.SubElement(bndbox, 'xmin').text = str(xmin)
-            ET.SubElement(bndbox, 'ymin').text = str(ymin)
-            ET.SubElement(bndbox, 'xmax').text = str(xmax)
-            ET.SubElement(bndbox, 'ymax').text = str(ymax)
+            # 添加对象节点, 空类名与原ElementTree输出一致写成<name/>
+            annotation.append(('object', [
+                ('name', class_dict.get(class_id, 'unknown') or None),
+                ('pose', 'Unspecified'),
+                ('truncated', '0'),
+                ('difficult', '0'),
+                bndbox(xmin, ymin, xmax, ymax),
+            ]))
 
         except Exception as e:
             logger.error(f"解析错误 {txt_path}:{line_num} - {str(e)}")
 
     # 美化输出并保存XML
-    xml_str = minidom.parseString(ET.tostring(annotation)).toprettyxml(indent="  ")
+    xml_str = to_pretty_xml('annotation', annotation)
     xml_output = os.path.join(xml_dir, f"{base_name}.xml")
 
     try:
@@ -180,6 +162,7 @@ def convert_yolo_to_voc(txt_dir: str, img_dir: str, xml_dir: str,
             if (i + 1) % 100 == 0 or (i + 1) == total_files:
                 logger.info(f"进度: {i + 1}/{total_files} | 成功: {success_count}")
 
+    get_default_store().flush()
     logger.info(f"转换完成! 成功: {success_count}/{total_files} | 失败: {total_files - success_count}")
 
 